@@ -0,0 +1,286 @@
+"""
+Offline per-stage benchmarks of the face and FHE pipeline.
+
+    python -m benchmarks.run [--repeat 20] [--profile default] [--dim 4096]
+                             [--output results.json] [--baseline previous.json --tolerance 0.25]
+
+Everything runs in this process: the bundled synthetic images in benchmarks/images,
+random unit-norm embeddings, a freshly generated context (the service's context/
+files are never touched) and an in-process stub of the main server. Every stage
+is timed separately after one warm-up call, and the results are written as JSON.
+With --baseline, stages whose median got slower than the tolerance are reported
+and the exit code is 1, so two releases can be compared directly.
+"""
+import argparse
+import asyncio
+import base64
+import glob
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import cv2
+import numpy as np
+import tenseal as ts
+from utils.tenseal_context import create_context
+from utils.image_utils import decode_image, decode_working_image
+from utils.face_utils import check_image_quality
+from utils.main_server_client import MainServerClient
+from utils.wire_format import BINARY_MEDIA_TYPE, parse_response
+from benchmarks.stub_server import StubServer
+from benchmarks.synthetic_faces import IMAGES_DIR, draw_face
+
+
+def summarize(samples):
+    ms = sorted(s * 1000 for s in samples)
+    return {
+        "n": len(ms),
+        "median_ms": round(statistics.median(ms), 3),
+        "mean_ms": round(statistics.fmean(ms), 3),
+        "p95_ms": round(ms[min(len(ms) - 1, int(round(0.95 * (len(ms) - 1))))], 3),
+        "min_ms": round(ms[0], 3),
+        "max_ms": round(ms[-1], 3),
+    }
+
+
+def time_calls(fn, inputs, repeat):
+    """Time `fn(x)` `repeat` times, cycling through `inputs`, after one untimed warm-up call."""
+    fn(inputs[0])
+    samples = []
+    for i in range(repeat):
+        x = inputs[i % len(inputs)]
+        start = time.perf_counter()
+        fn(x)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def large_image_stages(repeat, rng, size=(4032, 3024)):
+    """Full-size vs. working-resolution decode of a 12 MP phone-sized JPEG."""
+    img = cv2.resize(draw_face(rng), size, interpolation=cv2.INTER_CUBIC)
+    data = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes()
+    full = summarize(time_calls(decode_image, [data], repeat))
+    full["decoded_mib"] = round(decode_image(data).nbytes / 2**20, 2)
+    working = summarize(time_calls(decode_working_image, [data], repeat))
+    working["decoded_mib"] = round(decode_working_image(data)[0].nbytes / 2**20, 2)
+    return {"decode_12mp_full": full, "decode_12mp_working": working}
+
+
+def face_stages(image_bytes, repeat):
+    results = {"decode": summarize(time_calls(decode_image, image_bytes, repeat))}
+    images = [decode_image(data) for data in image_bytes]
+
+    face_stage_names = ["yunet_detection", "completeness_check", "anti_spoofing", "vgg_face_embedding"]
+    try:
+        from deepface import DeepFace
+        from deepface.modules import modeling
+        from utils.deepface_utils import DETECTOR_BACKEND, MODEL_NAME, embed_face
+        from utils.face_utils import check_face_completeness
+
+        # Model loading is a one-off startup cost, not part of any stage
+        start = time.perf_counter()
+        DeepFace.build_model(MODEL_NAME)
+        antispoof_model = modeling.build_model(task="spoofing", model_name="Fasnet")
+        model_load_seconds = time.perf_counter() - start
+    except Exception as e:
+        return {**results, **{name: {"skipped": f"{type(e).__name__}: {e}"} for name in face_stage_names}}
+
+    def detect(img):
+        # enforce_detection=False so drawn faces are timed even when the detector rejects them
+        return DeepFace.extract_faces(
+            img_path=img, detector_backend=DETECTOR_BACKEND, align=True,
+            anti_spoofing=False, enforce_detection=False,
+        )[0]
+
+    results["yunet_detection"] = summarize(time_calls(detect, images, repeat))
+    pairs = [(img, detect(img)) for img in images]
+    results["yunet_detection"]["faces_detected"] = sum(face["confidence"] > 0 for _, face in pairs)
+
+    def anti_spoof(pair):
+        img, face = pair
+        area = face["facial_area"]
+        return antispoof_model.analyze(img=img, facial_area=(area["x"], area["y"], area["w"], area["h"]))
+
+    results["completeness_check"] = summarize(time_calls(lambda p: check_face_completeness(p[1], p[0]), pairs, repeat))
+    results["anti_spoofing"] = summarize(time_calls(anti_spoof, pairs, repeat))
+    results["vgg_face_embedding"] = summarize(time_calls(lambda p: embed_face(p[1]["face"]), pairs, repeat))
+    results["vgg_face_embedding"]["model_load_seconds"] = round(model_load_seconds, 3)
+    return results
+
+
+def crypto_stages(profile, dim, repeat, rng):
+    context = create_context(profile)
+    # Context files are stored base64-encoded, so loading includes the decode
+    secret_file = base64.b64encode(context.serialize(save_secret_key=True))
+    public = context.copy()
+    public.make_context_public()
+    public_file = base64.b64encode(public.serialize())
+
+    embeddings = rng.standard_normal((max(repeat, 1), dim))
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    probes = list(embeddings.astype(np.float32))
+    template = ts.ckks_vector(context, embeddings[0]).serialize()
+
+    enc_probes = [ts.ckks_vector(context, p) for p in probes[:4]]
+    serialized = [enc.serialize() for enc in enc_probes]
+
+    def deserialize(data):
+        enc = ts.lazy_ckks_vector_from(data)
+        enc.link_context(public)
+        return enc
+
+    enc_template = deserialize(template)
+    server_probes = [deserialize(data) for data in serialized]
+    enc_scores = [enc.dot(enc_template) for enc in server_probes]
+    score_bytes = [enc.serialize() for enc in enc_scores]
+
+    def decrypt(data):
+        enc = ts.lazy_ckks_vector_from(data)
+        enc.link_context(context)
+        return enc.decrypt()
+
+    results = {
+        "context_load_secret": summarize(time_calls(lambda d: ts.context_from(base64.b64decode(d)), [secret_file], repeat)),
+        "context_load_public": summarize(time_calls(lambda d: ts.context_from(base64.b64decode(d)), [public_file], repeat)),
+        "ckks_encrypt": summarize(time_calls(lambda p: ts.ckks_vector(context, p), probes, repeat)),
+        "serialize": summarize(time_calls(lambda enc: enc.serialize(), enc_probes, repeat)),
+        "deserialize": summarize(time_calls(deserialize, serialized, repeat)),
+        "dot_product": summarize(time_calls(lambda enc: enc.dot(enc_template), server_probes, repeat)),
+        "decrypt": summarize(time_calls(decrypt, score_bytes, repeat)),
+    }
+    results["serialize"]["ciphertext_bytes"] = len(serialized[0])
+    results["context_load_public"]["serialized_bytes"] = len(public_file)
+    results["context_load_secret"]["serialized_bytes"] = len(secret_file)
+    return results, serialized, score_bytes
+
+
+def http_stage(serialized, score_bytes, repeat):
+    payload = {"results": [{"user_id": "bench", "encrypted_similarity": score_bytes[0]}]}
+    with StubServer(payload) as stub:
+        client = MainServerClient(stub.url)
+        headers = {"Accept": BINARY_MEDIA_TYPE}
+
+        async def hop(data):
+            resp = await client.post_ciphertext("/fhe/verify-with-embedding/", data, data={"session_id": "bench"}, headers=headers)
+            resp.raise_for_status()
+            return parse_response(resp.headers.get("content-type", ""), resp.content)
+
+        async def run():
+            await hop(serialized[0])
+            samples = []
+            for i in range(repeat):
+                start = time.perf_counter()
+                await hop(serialized[i % len(serialized)])
+                samples.append(time.perf_counter() - start)
+            await client.close()
+            return samples
+
+        return {"http_hop": summarize(asyncio.run(run()))}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Stages whose median is more than `tolerance` slower than in `baseline`."""
+    regressions = []
+    for name, stage in results["stages"].items():
+        before = baseline.get("stages", {}).get(name, {})
+        if "median_ms" not in stage or not before.get("median_ms"):
+            continue
+        ratio = stage["median_ms"] / before["median_ms"]
+        stage["baseline_median_ms"] = before["median_ms"]
+        stage["ratio_to_baseline"] = round(ratio, 3)
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--profile", default="default", help="CKKS parameter profile")
+    parser.add_argument("--dim", type=int, default=4096, help="embedding dimension (VGG-Face is 4096)")
+    parser.add_argument("--images", default=IMAGES_DIR)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-face", action="store_true", help="only run the crypto and transport stages")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed median slowdown vs. baseline")
+    args = parser.parse_args()
+
+    image_paths = sorted(glob.glob(os.path.join(args.images, "*.jpg")))
+    if not image_paths:
+        parser.error(f"No benchmark images in {args.images}; run python -m benchmarks.synthetic_faces")
+    image_bytes = []
+    for path in image_paths:
+        with open(path, "rb") as f:
+            image_bytes.append(f.read())
+
+    stages = {}
+    if args.skip_face:
+        stages["decode"] = summarize(time_calls(decode_image, image_bytes, args.repeat))
+    else:
+        stages.update(face_stages(image_bytes, args.repeat))
+    images = [decode_image(data) for data in image_bytes]
+    stages["quality_gate"] = summarize(time_calls(check_image_quality, images, args.repeat))
+    stages.update(large_image_stages(args.repeat, np.random.default_rng(args.seed)))
+    crypto, serialized, score_bytes = crypto_stages(args.profile, args.dim, args.repeat, np.random.default_rng(args.seed))
+    stages.update(crypto)
+    stages.update(http_stage(serialized, score_bytes, args.repeat))
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "tenseal": getattr(ts, "__version__", None),
+            "profile": args.profile,
+            "dim": args.dim,
+            "repeat": args.repeat,
+            "images": [os.path.basename(p) for p in image_paths],
+        },
+        "stages": stages,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        results["regressions"] = regressions
+
+    for name, stage in stages.items():
+        if "skipped" in stage:
+            line = f"skipped ({stage['skipped']})"
+        else:
+            line = f"median={stage['median_ms']:>10.3f}ms p95={stage['p95_ms']:>10.3f}ms"
+            if "ratio_to_baseline" in stage:
+                line += f" x{stage['ratio_to_baseline']:.2f} vs baseline"
+        print(f"{name:>22}: {line}", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if regressions:
+        print(f"Regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
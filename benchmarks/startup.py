@@ -0,0 +1,124 @@
+"""
+Startup time and memory of the service in each SERVICE_MODE.
+
+    python -m benchmarks.startup [--modes full crypto] [--repeat 3] [--settle 5] [--output startup.json]
+
+Keys are generated once into a temporary CONTEXT_DIR (timed as "keygen_seconds"),
+so every run below measures a restart with existing keys. Each run starts
+`uvicorn main:app` in a fresh process and reports:
+
+  ready_seconds      process start until /health answers
+  rss_ready_mib      resident memory at that point
+  rss_settled_mib    resident memory --settle seconds later (after background model preloading)
+  rss_peak_mib       peak resident memory of the process
+
+Memory figures come from /proc and are only available on Linux.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from benchmarks.stub_server import _free_port
+
+
+def _proc_status_mib(pid, field):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return round(int(line.split()[1]) / 1024, 1)  # kB
+    except OSError:
+        pass
+    return None
+
+
+def generate_keys(env):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "utils.tenseal_context"], env=env, check=True, stdout=subprocess.DEVNULL)
+    return round(time.perf_counter() - start, 3)
+
+
+def start_once(mode, env, settle, timeout=180):
+    port = _free_port()
+    env = dict(env, SERVICE_MODE=mode)
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{mode} mode exited during startup: {proc.stderr.read().decode()[-2000:]}")
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError(f"{mode} mode did not become ready within {timeout}s")
+            time.sleep(0.02)
+        result = {
+            "ready_seconds": round(time.perf_counter() - start, 3),
+            "rss_ready_mib": _proc_status_mib(proc.pid, "VmRSS"),
+        }
+        time.sleep(settle)
+        result["rss_settled_mib"] = _proc_status_mib(proc.pid, "VmRSS")
+        result["rss_peak_mib"] = _proc_status_mib(proc.pid, "VmHWM")
+        return result
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def _median(runs, key):
+    values = [run[key] for run in runs if run[key] is not None]
+    return round(statistics.median(values), 3) if values else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["full", "crypto"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--settle", type=float, default=5, help="seconds to wait before the settled memory reading")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as context_dir:
+        env = dict(os.environ, CONTEXT_DIR=context_dir)
+        keygen_seconds = generate_keys(env)
+        modes = {}
+        for mode in args.modes:
+            runs = [start_once(mode, env, args.settle) for _ in range(args.repeat)]
+            modes[mode] = {key: _median(runs, key) for key in runs[0]}
+            modes[mode]["runs"] = runs
+            print(f"{mode:>8}: ready={modes[mode]['ready_seconds']}s rss={modes[mode]['rss_ready_mib']}MiB "
+                  f"settled={modes[mode]['rss_settled_mib']}MiB peak={modes[mode]['rss_peak_mib']}MiB", file=sys.stderr)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "settle_seconds": args.settle,
+        },
+        "keygen_seconds": keygen_seconds,
+        "modes": modes,
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
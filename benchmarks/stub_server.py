@@ -0,0 +1,56 @@
+import socket
+import threading
+import time
+import uvicorn
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from utils.wire_format import ciphertext_response, read_ciphertext
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def build_app(verify_payload):
+    """
+    Stand-in for the main server. It answers the endpoints this service calls with
+    a fixed payload, so the HTTP hop is timed without any server-side FHE work.
+    """
+    app = FastAPI()
+
+    @app.post("/fhe/verify-with-embedding/")
+    async def verify_with_embedding(request: Request, file: UploadFile = File(...), session_id: str = Form(None)):
+        read_ciphertext(await file.read())
+        return ciphertext_response(request, verify_payload)
+
+    @app.post("/fhe/store-encrypted-embedding/")
+    async def store_encrypted_embedding(file: UploadFile = File(...), user_id: str = Form(...)):
+        read_ciphertext(await file.read())
+        return {"status": "stored", "user_id": user_id}
+
+    return app
+
+
+class StubServer:
+    """Runs the stub app with uvicorn on a background thread of this process."""
+
+    def __init__(self, verify_payload):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        config = uvicorn.Config(build_app(verify_payload), host="127.0.0.1", port=self.port, log_level="warning")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Stub main server did not start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
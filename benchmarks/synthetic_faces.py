@@ -0,0 +1,71 @@
+"""
+Deterministic synthetic face images for the benchmark suite.
+
+    python -m benchmarks.synthetic_faces [--output benchmarks/images] [--count 3]
+
+The generated JPEGs are committed under benchmarks/images so every run times the
+same inputs; this script only needs to run again to change them. They are drawn,
+not photographed, so a detector may report a low confidence on them — the
+benchmark times every stage regardless of the detection result.
+"""
+import argparse
+import os
+import cv2
+import numpy as np
+
+IMAGES_DIR = os.path.join(os.path.dirname(__file__), "images")
+
+
+def draw_face(rng, width=640, height=480):
+    # Background: soft vertical gradient plus sensor-like noise
+    gradient = np.linspace(rng.uniform(60, 120), rng.uniform(150, 220), height)[:, None, None]
+    img = np.repeat(np.repeat(gradient, width, axis=1), 3, axis=2)
+    img += rng.normal(0, 6, img.shape)
+    img = np.clip(img, 0, 255).astype(np.uint8)
+
+    cx = int(width / 2 + rng.uniform(-40, 40))
+    cy = int(height / 2 + rng.uniform(-20, 20))
+    fw = int(rng.uniform(95, 120))
+    fh = int(fw * rng.uniform(1.25, 1.4))
+    skin = tuple(int(c) for c in rng.uniform([120, 150, 190], [150, 180, 230]))  # BGR
+    hair = tuple(int(c) for c in rng.uniform(20, 70, 3))
+
+    # Neck and shoulders, hair, head
+    cv2.rectangle(img, (cx - fw // 3, cy + fh - 20), (cx + fw // 3, height), skin, -1)
+    cv2.ellipse(img, (cx, height + 40), (int(fw * 2.2), 140), 0, 180, 360, (90, 60, 40), -1)
+    cv2.ellipse(img, (cx, cy - fh // 5), (fw + 12, fh), 0, 180, 360, hair, -1)
+    cv2.ellipse(img, (cx, cy), (fw, fh), 0, 0, 360, skin, -1)
+
+    # Eyes, brows, nose and mouth at typical facial proportions
+    eye_y = cy - fh // 6
+    for side in (-1, 1):
+        ex = cx + side * fw // 2 - side * 8
+        cv2.ellipse(img, (ex, eye_y), (20, 10), 0, 0, 360, (235, 235, 235), -1)
+        cv2.circle(img, (ex, eye_y), 8, (60, 40, 30), -1)
+        cv2.circle(img, (ex, eye_y), 4, (10, 10, 10), -1)
+        cv2.ellipse(img, (ex, eye_y - 22), (26, 8), 0, 200, 340, hair, 5)
+    shade = tuple(int(c * 0.8) for c in skin)
+    cv2.line(img, (cx, eye_y + 5), (cx - 8, cy + fh // 4), shade, 4)
+    cv2.line(img, (cx - 8, cy + fh // 4), (cx + 6, cy + fh // 4 + 4), shade, 4)
+    cv2.ellipse(img, (cx, cy + fh // 2), (int(fw * 0.4), 14), 0, 10, 170, (70, 60, 160), 6)
+
+    return cv2.GaussianBlur(img, (5, 5), 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=IMAGES_DIR)
+    parser.add_argument("--count", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    rng = np.random.default_rng(args.seed)
+    for i in range(args.count):
+        path = os.path.join(args.output, f"face_{i:02d}.jpg")
+        cv2.imwrite(path, draw_face(rng), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,69 @@
-from fastapi import FastAPI
-from routers.embeddings_processing import router
-from routers.face_registration import router as face_registration_router
-from routers.face_verification import router as face_verification_router
-from utils.tenseal_context import ensure_context
+import asyncio
+import logging
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from routers.embeddings_processing import router, face_router
+from storage.embeddings_store import router as embeddings_store_router, gallery_router
+from storage.gallery import get_gallery
+from utils.tenseal_context import GALLERY_MATCHING, ensure_context, warm_up_contexts
+from utils.worker_pool import worker_pool
+from utils.analysis_cache import analysis_cache
+from utils.encryption_pool import zero_pool
+from utils.main_server_client import main_server
+from utils.metrics import REQUEST_SECONDS, REQUESTS_IN_FLIGHT, server_timing_header, start_request_timings
+from contextlib import asynccontextmanager
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
 
-ensure_context()
+load_dotenv()
+# "full" serves every endpoint; "crypto" only the FHE ones, and never imports DeepFace,
+# TensorFlow or OpenCV
+SERVICE_MODES = ("full", "crypto")
+SERVICE_MODE = os.getenv("SERVICE_MODE", "full")
+if SERVICE_MODE not in SERVICE_MODES:
+    raise ValueError(f"Unknown SERVICE_MODE '{SERVICE_MODE}'. Choose one of: {', '.join(SERVICE_MODES)}")
+# Full mode: import the face models in the background after startup, not on the first face request
+PRELOAD_FACE_MODELS = os.getenv("PRELOAD_FACE_MODELS", "true").lower() == "true"
+
+logger = logging.getLogger(__name__)
+
+
+def preload_face_models():
+    from utils import face_models
+    start = time.perf_counter()
+    try:
+        face_models.load()
+    except Exception as e:
+        logger.error(f"Preloading the face models failed: {e}")
+        return
+    logger.info(f"Face models imported in {time.perf_counter() - start:.1f}s")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Keys are generated (first run only) and loaded here rather than on import, off the event loop
+    await asyncio.to_thread(ensure_context)
+    await asyncio.to_thread(warm_up_contexts)
+    if GALLERY_MATCHING:
+        await asyncio.to_thread(get_gallery)
+    if SERVICE_MODE == "full" and PRELOAD_FACE_MODELS:
+        threading.Thread(target=preload_face_models, name="face-model-preload", daemon=True).start()
+    # One pooled keep-alive client to the main server for the app's lifetime
+    await main_server.start()
+    yield
+    await main_server.close()
+    worker_pool.shutdown()
+    zero_pool.shutdown()
+
 
 app = FastAPI(
     title="FHE Microservice",
     description="Handles encrypted face embedding operations using TenSEAL.",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -21,9 +74,60 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    timings = start_request_timings()
+    start = time.perf_counter()
+    status_code = 500
+    with REQUESTS_IN_FLIGHT.track_inprogress():
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+        finally:
+            elapsed = time.perf_counter() - start
+            # Route template, not the raw path, so user ids don't become label values
+            route = request.scope.get("route")
+            endpoint = route.path if route is not None else "unmatched"
+            REQUEST_SECONDS.labels(request.method, endpoint, str(status_code)).observe(elapsed)
+    timings.append(("total", elapsed))
+    response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
+
 app.include_router(router)
-app.include_router(face_registration_router)
-app.include_router(face_verification_router)
+# Encrypted template storage and compare: FHE-only, served in every mode
+app.include_router(embeddings_store_router)
+if GALLERY_MATCHING:
+    app.include_router(gallery_router)
+if SERVICE_MODE == "full":
+    from routers.face_registration import router as face_registration_router
+    from routers.face_verification import router as face_verification_router
+    from utils.face_utils import quality_rejection_counts
+
+    app.include_router(face_router)
+    app.include_router(face_registration_router)
+    app.include_router(face_verification_router)
+
+
+@app.get("/health")
+async def health():
+    # Served on the event loop, so it stays responsive while the worker pool is saturated
+    stats = {
+        "status": "ok",
+        "service_mode": SERVICE_MODE,
+        "worker_pool": worker_pool.stats(),
+        "analysis_cache": analysis_cache.stats(),
+        "encrypt_pool": zero_pool.stats(),
+    }
+    if SERVICE_MODE == "full":
+        stats["quality_rejections"] = quality_rejection_counts()
+    return stats
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8002, reload=True, log_level="info")
\ No newline at end of file
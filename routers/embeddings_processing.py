@@ -1,68 +1,152 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
-import requests
+import logging
 import os
-from dotenv import load_dotenv
-from utils.tenseal_context import load_secret_context
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Request
+from utils.tenseal_context import load_secret_context, context_registry, encrypt_vector
 import tenseal as ts
 import numpy as np
-import base64
-from utils.deepface_utils import extract_embedding
+from utils.packing import pack_embeddings, slot_count
+from utils.worker_pool import run_cpu
+from utils.main_server_client import main_server
+from utils.wire_format import ciphertext_response
+from utils.projection import get_projection, prepare_embedding
+from utils.metrics import timed
+from dotenv import load_dotenv
 
 load_dotenv()
-MAIN_SERVER_URL = os.getenv("SERVER_URL") + "/api/face/register-embedding/"
+MAIN_SERVER_PATH = "/api/face/register-embedding/"
+# Most embeddings one /encrypt-batch request may carry; split larger batches across requests
+ENCRYPT_BATCH_MAX = int(os.getenv("ENCRYPT_BATCH_MAX", "256"))
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+# Image endpoints, only mounted when SERVICE_MODE serves faces
+face_router = APIRouter()
+
+def _project_upload(embeddings):
+    """
+    Bring uploaded embeddings (one, or a row-per-embedding batch) into the space of the
+    active projection, as registration and verification do. Raw embeddings are projected,
+    ones already at the projection's output width (e.g. from /extract-embedding) are kept.
+    Returns (embeddings, projection version or None); other widths get a 400.
+    """
+    projection = get_projection()
+    if projection is None:
+        return embeddings, None
+    dim = embeddings.shape[-1]
+    if dim == projection.in_dim:
+        return projection.apply(embeddings).astype(np.float32), projection.version
+    if dim == projection.out_dim:
+        return embeddings, projection.version
+    raise HTTPException(
+        status_code=400,
+        detail=f"Embeddings have {dim} dims but projection {projection.version} maps "
+               f"{projection.in_dim} to {projection.out_dim} dims"
+    )
+
 
 @router.post("/encrypt")
-async def encrypt_embedding(file: UploadFile = File(...)):
+async def encrypt_embedding(request: Request, file: UploadFile = File(...)):
     embedding_bytes = await file.read()
-    embedding = np.frombuffer(embedding_bytes, dtype=np.float32)
+    embedding, projection_version = _project_upload(np.frombuffer(embedding_bytes, dtype=np.float32))
+    enc_bytes = await run_cpu(timed("encrypt", encrypt_vector), embedding)
+    # Base64 JSON by default, framed binary when the client accepts it
+    return ciphertext_response(request, {"encrypted": enc_bytes, "projection_version": projection_version})
+
+
+@router.post("/encrypt-batch")
+async def encrypt_embedding_batch(
+    request: Request,
+    file: UploadFile = File(...),
+    dim: int = Form(...)
+):
+    # The upload is N float32 embeddings of length `dim`, concatenated row by row
+    too_large = HTTPException(status_code=400, detail=f"Batch exceeds {ENCRYPT_BATCH_MAX} embeddings (ENCRYPT_BATCH_MAX)")
+    if dim > 0 and file.size is not None and file.size > ENCRYPT_BATCH_MAX * dim * 4:
+        raise too_large  # refused before the payload is read into memory
+    embedding_bytes = await file.read()
+    embeddings = np.frombuffer(embedding_bytes, dtype=np.float32)
+    if dim <= 0 or embeddings.size == 0 or embeddings.size % dim != 0:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Payload of {embeddings.size} floats is not a whole number of {dim}-dim embeddings"
+        )
+    if embeddings.size // dim > ENCRYPT_BATCH_MAX:
+        raise too_large
+
+    # A (batch, 4096) projection is a sizeable matmul; keep it off the event loop
+    embeddings, projection_version = await run_cpu(_project_upload, embeddings.reshape(-1, dim))
     context = load_secret_context()
-    enc_vec = ts.ckks_vector(context, embedding)
-    enc_bytes = enc_vec.serialize()
-    # Base64 encode for safe transport
-    return {"encrypted": base64.b64encode(enc_bytes).decode("utf-8")}
+    try:
+        vectors, layout = pack_embeddings(embeddings, slot_count(context))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def encrypt_all():
+        return [encrypt_vector(vector, context) for vector in vectors]
+
+    ciphertexts = await run_cpu(timed("encrypt", encrypt_all))
+    return ciphertext_response(
+        request, {"ciphertexts": ciphertexts, "layout": layout, "projection_version": projection_version}
+    )
 
 
-@router.post("/extract-embedding")
+@router.get("/context-stats")
+def context_stats():
+    # Load time and serialized size of every context held by the registry
+    stats = context_registry.stats()
+    projection = get_projection()
+    stats["projection"] = None if projection is None else {
+        "version": projection.version,
+        "input_dim": projection.in_dim,
+        "output_dim": projection.out_dim,
+    }
+    return stats
+
+
+@face_router.post("/extract-embedding")
 async def extract_embedding_route(file: UploadFile = File(...)):
-    temp_path = f"/tmp/{file.filename}"
-    with open(temp_path, "wb") as f:
-        f.write(await file.read())
+    # Imported here so crypto-only workers never load OpenCV
+    from utils.face_models import extract_embedding
+    from utils.image_utils import decode_image
+
+    img = await run_cpu(decode_image, await file.read())
+    if img is None:
+        raise HTTPException(status_code=400, detail="Failed to read image. Please upload a valid image file.")
     try:
-        embedding = extract_embedding(temp_path)
-        return {"embedding": embedding}
+        embedding = await run_cpu(extract_embedding, img)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        os.remove(temp_path)
+    # Projected like the embeddings registration and verification encrypt
+    embedding, projection_version = prepare_embedding(embedding)
+    return {"embedding": embedding.tolist(), "projection_version": projection_version}
 
 
 
 @router.get("/test-fhe-roundtrip")
-def test_fhe_roundtrip():
+async def test_fhe_roundtrip():
     # 1. Generate random embedding
     embedding = np.random.rand(512).astype(np.float32)
-    embedding_bytes = embedding.tobytes()
 
     # 2. Encrypt with secret context
     context = load_secret_context()
-    enc_vec = ts.ckks_vector(context, embedding)
-    enc_bytes = enc_vec.serialize()
+    enc_bytes = await run_cpu(encrypt_vector, embedding, context)
 
     # 3. Send to server for similarity test (server must have a test endpoint)
-    files = {'file': ('embedding.bin', enc_bytes)}
-    resp = requests.post(f"{MAIN_SERVER_URL}/test-similarity/", files=files)
+    resp = await main_server.post_ciphertext(f"{MAIN_SERVER_PATH}test-similarity/", enc_bytes, idempotent=True)
     if resp.status_code != 200:
         raise HTTPException(status_code=500, detail="Server FHE test failed")
-    enc_result_bytes = resp.content
 
     # 4. Decrypt result
-    enc_result = ts.lazy_ckks_vector_from(enc_result_bytes)
-    enc_result.link_context(context)
-    decrypted = enc_result.decrypt()[0]
+    def decrypt_result(enc_result_bytes):
+        enc_result = ts.lazy_ckks_vector_from(enc_result_bytes)
+        enc_result.link_context(context)
+        return enc_result.decrypt()[0]
+
+    decrypted = await run_cpu(timed("decrypt", decrypt_result), resp.content)
 
     # 5. Compute expected (dot product with itself)
     expected = float(np.dot(embedding, embedding))
-    print(f"Decrypted: {decrypted:.6f}, Expected: {expected:.6f}")
-    return {"decrypted": decrypted, "expected": expected, "error": abs(decrypted - expected)}
\ No newline at end of file
+    logger.info(f"FHE roundtrip: decrypted {decrypted:.6f}, expected {expected:.6f}")
+    return {"decrypted": decrypted, "expected": expected, "error": abs(decrypted - expected)}
@@ -1,120 +1,111 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException, Form, status # Import status
-from utils.deepface_utils import extract_embedding
-from utils.tenseal_context import load_secret_context
-from utils.face_utils import check_face_completeness
-import numpy as np
-import tenseal as ts
-import requests
+from typing import List
+from utils.tenseal_context import encrypt_vector
+from utils.face_pipeline import analyze_upload, analyze_frames, build_template, FaceRejected, TEMPLATE_METHODS
+from utils.worker_pool import run_cpu
+from utils.main_server_client import main_server
+from utils.projection import prepare_embedding
+from utils.metrics import stage, timed
+import httpx
 import os
-import cv2
-from deepface import DeepFace
-import tempfile # Import tempfile for secure temporary file creation
+
+ENROLL_MAX_FRAMES = int(os.getenv("ENROLL_MAX_FRAMES", "10"))
 
 router = APIRouter()
-SERVER_URL = os.getenv("SERVER_URL")
+
+
+async def store_template(user_id, embedding):
+    """Project, encrypt and upload one template to the main server; returns its JSON reply."""
+    # Project + L2-normalize if a projection is stored next to the context
+    embedding_np, projection_version = prepare_embedding(embedding)
+
+    # Encrypt with the shared secret context on the worker pool
+    enc_bytes = await run_cpu(timed("encrypt", encrypt_vector), embedding_np)
+
+    # Send encrypted embedding to the server
+    data = {'user_id': user_id}
+    if projection_version:
+        data['projection_version'] = projection_version
+
+    try:
+        with stage("main_server"):
+            resp = await main_server.post_ciphertext("/fhe/store-encrypted-embedding/", enc_bytes, data=data)
+        resp.raise_for_status() # This will raise HTTPStatusError for 4xx/5xx responses
+        return resp.json()
+    except httpx.HTTPStatusError as http_err: # <--- CATCH SPECIFICALLY HTTPStatusError
+        # Attempt to parse JSON detail from the main backend's response
+        try:
+            error_detail = http_err.response.json().get("detail", str(http_err))
+        except ValueError: # If response is not JSON
+            error_detail = str(http_err) # Fallback to generic HTTPError message
+
+        # Re-raise as HTTPException with the specific status code and detail
+        raise HTTPException(status_code=http_err.response.status_code, detail=error_detail)
 
 @router.post("/register-face/")
 async def register_face(
     user_id: str = Form(...),
     file: UploadFile = File(...)
 ):
-    temp_path: str = None # Initialize temp_path to None
     try:
-        # Use tempfile.NamedTemporaryFile for secure temporary file creation
-        # delete=False means we manually delete it in the finally block
-        # suffix ensures it has a .jpg extension for DeepFace
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_file:
-            temp_file.write(await file.read())
-            temp_path = temp_file.name # Get the actual path of the temporary file
-
-        # Step 1: Face detection
-        img = cv2.imread(temp_path)
-        if img is None:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST, # Use status.HTTP_400_BAD_REQUEST for consistency
-                detail="Failed to read image. Please upload a valid image file."
-            )
-        detector_to_use = "yunet"  # or your preferred detector
-
+        # Steps 1-4: decode in memory, detect once, then completeness, anti-spoofing and
+        # embedding on the same face; a retried upload of the same bytes hits the analysis cache
         try:
-            face_objs = DeepFace.extract_faces(
-                img_path=temp_path,
-                detector_backend=detector_to_use,
-                align=True
-            )
-        except Exception as e:
-            if "face could not be detected" in str(e).lower() or "no face" in str(e).lower():
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="No face detected in the image. Please ensure your face is clearly visible and try again."
-                )
-            raise
+            analysis = await run_cpu(analyze_upload, await file.read(), "registration")
+        except FaceRejected as rejected:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=rejected.detail)
+        # Step 5: encrypt and send the embedding to the server
+        return await store_template(user_id, analysis["embedding"])
 
-        if not face_objs or len(face_objs) == 0:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="No face detected in the image. Please ensure your face is clearly visible and try again."
-            )
+    except HTTPException:
+        raise # Re-raise FastAPI's HTTPException directly (e.g., from face detection, completeness, anti-spoofing checks)
+    except Exception as e:
+        # Catch any other truly unexpected errors and return a 500
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred during registration: {str(e)}")
 
-        # Step 2: Completeness check
-        is_complete, error_message = check_face_completeness(face_objs[0], img)
-        if not is_complete:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Incomplete face detected: {error_message}. Please ensure your entire face is visible and centered in the frame."
-            )
 
-        # Step 3: Anti-spoofing check
-        anti_spoof_faces = DeepFace.extract_faces(
-            img_path=temp_path,
-            anti_spoofing=True
+@router.post("/register-face-batch/")
+async def register_face_batch(
+    user_id: str = Form(...),
+    files: List[UploadFile] = File(...),
+    template_method: str = Form("mean")
+):
+    """
+    Enroll one user from several frames: each frame is checked like /register-face/,
+    the accepted faces are embedded in one batch and combined into a single template,
+    which is encrypted and uploaded once.
+    """
+    if template_method not in TEMPLATE_METHODS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"template_method must be one of: {', '.join(TEMPLATE_METHODS)}"
         )
-        is_spoof = True
-        if anti_spoof_faces and len(anti_spoof_faces) > 0:
-            face_obj = anti_spoof_faces[0]
-            is_real = face_obj.get("is_real", False)
-            if is_real:
-                is_spoof = False
-        if is_spoof:
+    if len(files) > ENROLL_MAX_FRAMES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {ENROLL_MAX_FRAMES} frames can be enrolled at once."
+        )
+    try:
+        uploads = [await f.read() for f in files]
+        embeddings, accepted, rejected = await run_cpu(analyze_frames, uploads, "registration")
+        if not accepted:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Potential spoofing detected. Please use a real face for registration."
+                detail={"message": "No usable face in any frame.", "rejected_frames": rejected}
             )
-          
-        # Step 4: Extract embedding and encrypt with TenSEAL
-        embedding = extract_embedding(temp_path)
-        embedding_np = np.array(embedding, dtype=np.float32)
-        
-        # Load secret context (consider loading this once globally if static)
-        context = load_secret_context() 
-        
-        enc_vec = ts.ckks_vector(context, embedding_np)
-        enc_bytes = enc_vec.serialize() # TenSEAL's built-in serialization
 
-        # Step 5: Send encrypted embedding to the server
-        files = {'file': ('embedding.bin', enc_bytes)}
-        data = {'user_id': user_id}
+        template, kept = build_template(embeddings, template_method)
+        outliers = [accepted[i] for i in range(len(accepted)) if i not in kept]
+        result = await store_template(user_id, template)
+        if isinstance(result, dict):
+            result.update({
+                "frames_used": [accepted[i] for i in kept],
+                "frames_outliers": outliers,
+                "frames_rejected": rejected,
+            })
+        return result
 
-        try:
-            resp = requests.post(f"{SERVER_URL}/fhe/store-encrypted-embedding/", data=data, files=files)
-            resp.raise_for_status() # This will raise HTTPError for 4xx/5xx responses
-            return resp.json()
-        except requests.exceptions.HTTPError as http_err: # <--- CATCH SPECIFICALLY HTTPError
-            # Attempt to parse JSON detail from the main backend's response
-            try:
-                error_detail = http_err.response.json().get("detail", str(http_err))
-            except ValueError: # If response is not JSON
-                error_detail = str(http_err) # Fallback to generic HTTPError message
-            
-            # Re-raise as HTTPException with the specific status code and detail
-            raise HTTPException(status_code=http_err.response.status_code, detail=error_detail)
-        
     except HTTPException:
-        raise # Re-raise FastAPI's HTTPException directly (e.g., from face detection, completeness, anti-spoofing checks)
+        raise
     except Exception as e:
-        # Catch any other truly unexpected errors and return a 500
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred during registration: {str(e)}")
-    finally:
-        # Ensure the temporary file is deleted
-        if temp_path and os.path.exists(temp_path):
-            os.remove(temp_path)
\ No newline at end of file
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred during batch registration: {str(e)}")
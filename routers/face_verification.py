@@ -1,21 +1,18 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request, WebSocket
 from typing import Optional
-import tempfile
-import os
-import requests
-import base64
-import numpy as np
-import tenseal as ts
-from utils.deepface_utils import extract_embedding
-from utils.tenseal_context import load_secret_context
-from utils.face_utils import check_face_completeness
-import os
-import tempfile
-import base64
-import numpy as np
+import asyncio
+from utils.tenseal_context import load_secret_context, encrypt_vector
+from utils.face_pipeline import analyze_upload, check_quality, detect_face, screen_face, FaceRejected
+from utils.face_models import embed_face
+from utils.image_utils import decode_image
+from utils.scoring import decrypt_and_rank
+from utils.worker_pool import begin_request, run_cpu
+from utils.main_server_client import main_server
+from utils.wire_format import parse_response, to_json_payload, BINARY_MEDIA_TYPE
+from utils.projection import prepare_embedding
+from utils.metrics import stage, timed, GALLERY_RESULTS
 import logging
-from deepface import DeepFace
-import cv2
+import os
 
 
 logging.basicConfig(
@@ -23,163 +20,186 @@ logging.basicConfig(
     format="%(asctime)s %(levelname)s %(name)s: %(message)s"
 )
 
-COSINE_THRESHOLD = 0.55
+# Projected embeddings usually need their own threshold (see `python -m utils.projection evaluate`)
+COSINE_THRESHOLD = float(os.getenv("COSINE_THRESHOLD", "0.55"))
+BINARY_ACCEPT = f"{BINARY_MEDIA_TYPE}, application/json;q=0.9"
+
+# Streaming verification: frames processed per connection, seconds without a decision,
+# encrypted matches attempted, and how far from the threshold a score must be to stop early
+STREAM_MAX_FRAMES = int(os.getenv("STREAM_MAX_FRAMES", "150"))
+STREAM_TIMEOUT = float(os.getenv("STREAM_TIMEOUT", "30"))
+STREAM_MAX_MATCHES = int(os.getenv("STREAM_MAX_MATCHES", "3"))
+STREAM_DECISION_MARGIN = float(os.getenv("STREAM_DECISION_MARGIN", "0.05"))
 
 router = APIRouter(tags=["Verification Operations"])
-SERVER_URL = os.getenv("SERVER_URL")
 logger = logging.getLogger(__name__)
 
+async def match_embedding(embedding, session_id=None, top_k=5):
+    """Encrypt an embedding, match it on the main server and decrypt and rank the scores."""
+    embedding_np, projection_version = prepare_embedding(embedding)
+    context = load_secret_context()
+    enc_bytes = await run_cpu(timed("encrypt", encrypt_vector), embedding_np, context)
+
+    data = {"session_id": session_id} if session_id else {}
+    if projection_version:
+        # Lets the main server refuse templates enrolled under a different projection
+        data["projection_version"] = projection_version
+
+    # Send to FHE server for verification (read-only, so safe to retry)
+    with stage("main_server"):
+        server_resp = await main_server.post_ciphertext(
+            "/fhe/verify-with-embedding/", enc_bytes, data=data,
+            headers={"Accept": BINARY_ACCEPT}, idempotent=True
+        )
+    server_resp.raise_for_status()
+    # Framed binary if the main server supports it, base64 JSON otherwise
+    server_data = parse_response(server_resp.headers.get("content-type", ""), server_resp.content)
+
+    # Bulk decrypt and rank off the event loop
+    server_data = await run_cpu(
+        timed("decrypt", decrypt_and_rank), server_data, context, COSINE_THRESHOLD, top_k
+    )
+    GALLERY_RESULTS.observe(len(server_data.get("results", [])))
+    # Ciphertexts received over the binary transport are raw bytes; answer clients in JSON form
+    return to_json_payload(server_data)
+
 @router.post("/verify-face/")
 async def verify_face(
     file: UploadFile = File(...),
     session_id: str = Form(None),
+    top_k: int = Form(5),
     request: Request = None
 ):
-    temp_path = None
     try:
-        # Save uploaded file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp:
-            contents = await file.read()
-            temp.write(contents)
-            temp_path = temp.name
+        # Decode in memory, detect once, then completeness, anti-spoofing and embedding on
+        # the same face; a retried upload of the same bytes is served from the analysis cache
+        try:
+            analysis = await run_cpu(analyze_upload, await file.read(), "verification")
+        except FaceRejected as rejected:
+            raise HTTPException(status_code=400, detail=rejected.detail)
 
-        logger.info(f"Image saved to temporary file: {temp_path}")
+        return await match_embedding(analysis["embedding"], session_id, top_k)
 
+    except HTTPException as http_ex:
+        raise http_ex  # <-- This will return the correct status code and message
+    except Exception as e:
+        logger.error(f"Error in FHE direct verification: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"FHE direct verification failed: {e}")
 
-        img = cv2.imread(temp_path)
-        if img is None:
-            raise HTTPException(
-                status_code=400,
-                detail="Failed to read image. Please upload a valid image file."
-            )
 
-        detector_to_use = "yunet" 
-        try: 
-        # Step 1: Extract faces to check if a face is detected
-            try:
-                face_objs = DeepFace.extract_faces(
-                    img_path=temp_path,
-                    detector_backend=detector_to_use,
-                    align=True
-                )
-            except Exception as e:
-                # DeepFace may raise an exception if no face is detected
-                if "face could not be detected" in str(e).lower() or "no face" in str(e).lower():
-                    raise HTTPException(
-                        status_code=400,
-                        detail="No face detected in the image. Please ensure your face is clearly visible and try again."
-                    )
-                raise  
-
-            if not face_objs or len(face_objs) == 0:
-                raise HTTPException(
-                    status_code=400,
-                    detail="No face detected in the image. Please ensure your face is clearly visible and try again."
-                )
-
-            # Step 2: Check completeness
-            is_complete, error_message = check_face_completeness(face_objs[0], img)
-            if not is_complete:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Incomplete face detected: {error_message}. Please ensure your entire face is visible and centered in the frame."
-                )
-            logger.info("Face completeness check passed")
-
-            # Step 3: Anti-spoofing check (only if face was detected)
+def _check_frame(data, search_area):
+    """
+    Decode and screen one streamed frame. Returns (face_obj, rejection detail or None);
+    face_obj is None when no face was found.
+    """
+    img = decode_image(data)
+    if img is None:
+        return None, "Failed to read image."
+    try:
+        # Blurry or badly exposed kiosk frames are dropped before the detector runs
+        check_quality(img)
+        face_obj = detect_face(img, search_area)
+    except FaceRejected as rejected:
+        return None, rejected.detail
+    try:
+        screen_face(img, face_obj, "verification")
+    except FaceRejected as rejected:
+        return face_obj, rejected.detail
+    return face_obj, None
+
+
+@router.websocket("/ws/verify-face")
+async def verify_face_stream(websocket: WebSocket, session_id: Optional[str] = None, top_k: int = 5):
+    """
+    Streaming verification: the client sends camera frames as binary messages and
+    gets a JSON message back for every frame that was processed.
+
+    Frames that arrive while the previous one is still being processed are dropped,
+    so the pipeline always works on the newest frame. The face found in one frame
+    narrows the detector's search window in the next. Only a frame that passes the
+    completeness and anti-spoofing checks is embedded and matched; the stream ends
+    with a "result" message as soon as a score is clearly above or below the
+    threshold (or after STREAM_MAX_MATCHES attempts), or with "timeout" /
+    "frame_limit" when no decision was reached.
+    """
+    await websocket.accept()
+    latest = {"data": None, "index": -1}
+    frame_ready = asyncio.Event()
+    disconnected = asyncio.Event()
+    counts = {"received": 0, "dropped": 0, "processed": 0, "matches": 0}
+
+    async def receive_frames():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                disconnected.set()
+                frame_ready.set()
+                return
+            if message.get("bytes") is None:
+                continue
+            if latest["data"] is not None:
+                counts["dropped"] += 1  # the pipeline never got to the previous frame
+            latest["data"], latest["index"] = message["bytes"], counts["received"]
+            counts["received"] += 1
+            frame_ready.set()
+
+    receiver = asyncio.create_task(receive_frames())
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STREAM_TIMEOUT
+    search_area = None
+    try:
+        while counts["processed"] < STREAM_MAX_FRAMES:
             try:
-                anti_spoof_faces = DeepFace.extract_faces(
-                    img_path=temp_path,
-                    anti_spoofing=True
-                )
-                is_spoof = True
-                if anti_spoof_faces and len(anti_spoof_faces) > 0:
-                    face_obj = anti_spoof_faces[0]
-                    is_real = face_obj.get("is_real", False)
-                    if is_real:
-                        is_spoof = False
-                if is_spoof:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Potential spoofing detected. Please use a real face for verification."
-                    )
-            except Exception as spoof_e:
-                logger.warning(f"Anti-spoofing check failed or not available: {str(spoof_e)}")
-                # If the error message is about no face, return the same as step 1
-                if "face could not be detected" in str(spoof_e).lower() or "no face" in str(spoof_e).lower():
-                    raise HTTPException(
-                        status_code=400,
-                        detail="No face detected in the image. Please ensure your face is clearly visible and try again."
-                    )
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Anti-spoofing failed: {str(spoof_e)}"
-                )
-
-        except HTTPException as http_ex:
-            raise http_ex
-
-        embedding = extract_embedding(temp_path)
-        embedding_np = np.array(embedding, dtype=np.float32)
-        context = load_secret_context()
-        enc_vec = ts.ckks_vector(context, embedding_np)
-        enc_bytes = enc_vec.serialize()
-
-        form_data = {
-            "session_id": (None, session_id) if session_id else None,
-            "file": ("embedding.bin", enc_bytes, "application/octet-stream"),
-        }
-        form_data = {k: v for k, v in form_data.items() if v is not None}
-
-        # Send to FHE server for verification
-        server_resp = requests.post(
-            f"{SERVER_URL}/fhe/verify-with-embedding/",
-            files=form_data,
-            timeout=60,
-        )
-        server_resp.raise_for_status()
-        server_data = server_resp.json()
-
-        context = load_secret_context()
-        highest_similarity = float("-inf")
-        best_match = None
+                await asyncio.wait_for(frame_ready.wait(), timeout=max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                await websocket.send_json({"type": "timeout", **counts})
+                break
+            if disconnected.is_set():
+                return
+            frame_ready.clear()
+            data, index = latest["data"], latest["index"]
+            latest["data"] = None
+            counts["processed"] += 1
+            # Admission is per frame: a busy pool drops frames, not the whole stream
+            begin_request()
 
-        for result in server_data.get("results", []):
             try:
-                enc_sim_bytes = base64.b64decode(result["encrypted_similarity"])
-                enc_sim = ts.lazy_ckks_vector_from(enc_sim_bytes)
-                enc_sim.link_context(context)
-                sim_value = enc_sim.decrypt()[0]
-                result["similarity"] = sim_value
-
-                # Log the decrypted similarity for each user
-                logger.info(
-                    f"Decrypted similarity for user {result.get('user_id')}, "
-                    f"{result.get('full_name')}: {sim_value:.4f}"
-                )
-
-                if sim_value > highest_similarity:
-                    highest_similarity = sim_value
-                    best_match = result
-            except Exception as e:
-                result["similarity"] = None
-                result["decrypt_error"] = str(e)
-                logger.error(
-                    f"Error decrypting similarity for user {result.get('user_id')}: {e}"
-                )
-
-        server_data["highest_similarity"] = highest_similarity if highest_similarity != float("-inf") else None
-        server_data["best_match"] = best_match
-        server_data["match_found"] = bool(best_match and highest_similarity > COSINE_THRESHOLD)
-
-        return server_data
+                face_obj, rejection = await run_cpu(_check_frame, data, search_area)
+            except HTTPException as busy:
+                # Worker pool full: drop this frame, the next one will be tried
+                await websocket.send_json({"type": "frame", "frame": index, "status": "busy", "detail": busy.detail})
+                continue
+            search_area = None if face_obj is None else face_obj["facial_area"]
+            if rejection is not None:
+                await websocket.send_json({"type": "frame", "frame": index, "status": "rejected", "detail": rejection})
+                continue
 
-    except HTTPException as http_ex:
-        raise http_ex  # <-- This will return the correct status code and message
+            try:
+                embedding = await run_cpu(timed("embedding", embed_face), face_obj["face"])
+                server_data = await match_embedding(embedding, session_id, top_k)
+            except HTTPException as busy:
+                await websocket.send_json({"type": "frame", "frame": index, "status": "busy", "detail": busy.detail})
+                continue
+            counts["matches"] += 1
+
+            score = server_data.get("highest_similarity")
+            confident = score is not None and abs(score - COSINE_THRESHOLD) >= STREAM_DECISION_MARGIN
+            if confident or counts["matches"] >= STREAM_MAX_MATCHES:
+                await websocket.send_json({
+                    "type": "result", "frame": index, "confident": confident, **counts, **server_data
+                })
+                break
+            await websocket.send_json({
+                "type": "frame", "frame": index, "status": "inconclusive", "highest_similarity": score
+            })
+        else:
+            await websocket.send_json({"type": "frame_limit", **counts})
+        await websocket.close()
     except Exception as e:
-        logger.error(f"Error in FHE direct verification: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"FHE direct verification failed: {e}")
+        if disconnected.is_set():
+            return
+        logger.error(f"Error in streaming verification: {str(e)}")
+        await websocket.send_json({"type": "error", "detail": f"FHE streaming verification failed: {e}"})
+        await websocket.close(code=1011)
     finally:
-        if temp_path and os.path.exists(temp_path):
-            os.unlink(temp_path)
-            logger.info("Temporary file deleted")
\ No newline at end of file
+        receiver.cancel()
@@ -1,43 +1,171 @@
 import os
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
-from utils.tenseal_utils import load_public_context
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Request
+from utils.tenseal_context import load_public_context
+from utils.packing import slot_count
+from utils.projection import get_projection, prepare_embedding
+from utils.wire_format import ciphertext_response, read_ciphertext
+from utils.worker_pool import run_cpu
+from storage.gallery import get_gallery
+from storage.segment_store import SegmentStore
+from storage.template_cache import template_cache
+import logging
 import tenseal as ts
-import base64
+import numpy as np
 
 EMBEDDINGS_DIR = "storage/embeddings"
 router = APIRouter()
+# 1:N gallery endpoints, only mounted with GALLERY_MATCHING (the public context then needs matmul keys)
+gallery_router = APIRouter()
+logger = logging.getLogger(__name__)
+
+store = SegmentStore(EMBEDDINGS_DIR)
+
+
+def _import_legacy_files():
+    # Earlier versions wrote one {user_id}.bin per user; fold those into the segments once.
+    # Imported files are renamed to *.bin.imported so a later delete isn't undone on restart.
+    # Every worker runs this at import; the store lock lets only one of them do the work.
+    with store.locked():
+        legacy = [f for f in os.listdir(EMBEDDINGS_DIR) if f.endswith(".bin") and f != "index.bin"]
+        if not legacy:
+            return
+        imported = 0
+        for name in legacy:
+            user_id, path = name[:-len(".bin")], os.path.join(EMBEDDINGS_DIR, name)
+            try:
+                if user_id not in store:
+                    with open(path, "rb") as f:
+                        store.put(user_id, f.read())
+                    imported += 1
+                os.replace(path, path + ".imported")
+            except FileNotFoundError:
+                pass  # already imported and renamed by another process
+        store.flush_index()
+        logger.info(f"Imported {imported} legacy embedding files into the segment store")
+
+
+_import_legacy_files()
 
 def save_embedding(user_id, embedding_bytes):
-    os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
-    with open(f"{EMBEDDINGS_DIR}/{user_id}.bin", "wb") as f:
-        f.write(embedding_bytes)
+    version = store.put(user_id, embedding_bytes)
+    template_cache.invalidate(user_id)
+    return version
 
 def load_embedding(user_id):
-    with open(f"{EMBEDDINGS_DIR}/{user_id}.bin", "rb") as f:
-        return f.read()
+    return store.get(user_id)[1]
+
+def delete_embedding(user_id):
+    template_cache.invalidate(user_id)
+    return store.delete(user_id)
+
+def load_template(user_id, context):
+    """Deserialized, context-linked template; cached per (user_id, version). Raises KeyError."""
+    version = store.version(user_id)
+    if version is None:
+        raise KeyError(user_id)
+    enc = template_cache.get(user_id, version, context)
+    if enc is None:
+        version, data = store.get(user_id)
+        enc = ts.lazy_ckks_vector_from(data)
+        enc.link_context(context)
+        template_cache.put(user_id, version, enc, context)
+    return enc
 
 def list_user_ids():
-    return [f.split(".")[0] for f in os.listdir(EMBEDDINGS_DIR) if f.endswith(".bin")]
+    return store.user_ids()
+
+def iter_embeddings():
+    """(user_id, version, bytes) for every stored template, in one sequential pass."""
+    return store.iter_items()
 
 @router.post("/register-embedding/")
 async def register_embedding(user_id: str = Form(...), file: UploadFile = File(...)):
-    encrypted_data = await file.read()
-    save_embedding(user_id, encrypted_data)
-    return {"status": "registered", "user_id": user_id}
+    try:
+        encrypted_data = read_ciphertext(await file.read())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # The segment append fsyncs; keep it off the event loop
+    version = await run_cpu(save_embedding, user_id, encrypted_data)
+    return {"status": "registered", "user_id": user_id, "version": version}
 
-@router.post("/compare-embedding/")
-async def compare_embedding(user_id: str = Form(...), file: UploadFile = File(...)):
-    # Load stored embedding for user
-    stored_bytes = load_embedding(user_id)
-    uploaded_bytes = await file.read()
+@router.delete("/embedding/{user_id}")
+async def remove_embedding(user_id: str):
+    if not await run_cpu(delete_embedding, user_id):
+        raise HTTPException(status_code=404, detail=f"No embedding registered for user {user_id}")
+    return {"status": "deleted", "user_id": user_id}
+
+def _compare_embedding(user_id, uploaded_bytes):
     context = load_public_context()
-    # Deserialize vectors
-    enc_stored = ts.lazy_ckks_vector_from(stored_bytes)
-    enc_stored.link_context(context)
+    # Stored template comes from the LRU cache when the user compared recently
+    enc_stored = load_template(user_id, context)
     enc_uploaded = ts.lazy_ckks_vector_from(uploaded_bytes)
     enc_uploaded.link_context(context)
     # Compute squared Euclidean distance (encrypted)
     diff = enc_stored - enc_uploaded
-    enc_dist2 = diff.dot(diff)
+    return diff.dot(diff).serialize()
+
+@router.post("/compare-embedding/")
+async def compare_embedding(request: Request, user_id: str = Form(...), file: UploadFile = File(...)):
+    try:
+        uploaded_bytes = read_ciphertext(await file.read())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        enc_dist2 = await run_cpu(_compare_embedding, user_id, uploaded_bytes)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"No embedding registered for user {user_id}")
     # Return encrypted result (client will decrypt)
-    return {"enc_distance": base64.b64encode(enc_dist2.serialize()).decode()}
\ No newline at end of file
+    return ciphertext_response(request, {"enc_distance": enc_dist2})
+
+
+@router.get("/template-cache-stats")
+async def template_cache_stats():
+    return template_cache.stats()
+
+
+def _register_gallery_template(user_id, embedding):
+    # Raw embeddings go through the active projection, so they share the space of the
+    # (projected) encrypted probes; templates already at the projected width are kept as is
+    projection, projection_version = get_projection(), None
+    if projection is not None and embedding.size == projection.in_dim:
+        embedding, projection_version = prepare_embedding(embedding)
+    gallery = get_gallery()
+    gallery.add(user_id, embedding)
+    return len(gallery), projection_version
+
+@gallery_router.post("/register-gallery-template/")
+async def register_gallery_template(user_id: str = Form(...), file: UploadFile = File(...)):
+    # Plaintext float32 template for the packed 1:N gallery
+    embedding = np.frombuffer(await file.read(), dtype=np.float32)
+    try:
+        gallery_size, projection_version = await run_cpu(_register_gallery_template, user_id, embedding)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "status": "registered",
+        "user_id": user_id,
+        "gallery_size": gallery_size,
+        "projection_version": projection_version,
+    }
+
+def _match_gallery(probe_bytes):
+    context = load_public_context()
+    enc_probe = ts.lazy_ckks_vector_from(probe_bytes)
+    enc_probe.link_context(context)
+    slots = slot_count(context)
+    chunks = get_gallery().match(enc_probe, slots)
+    # One ciphertext of scores per `slots` users; user_ids give the slot order
+    return {
+        "encrypted_scores": [enc.serialize() for enc, _ in chunks],
+        "user_ids": [user_id for _, ids in chunks for user_id in ids],
+        "scores_per_ciphertext": slots,
+    }
+
+@gallery_router.post("/match-gallery/")
+async def match_gallery(request: Request, file: UploadFile = File(...)):
+    # Seconds of rotations per block (see "Gallery matching" in the README): keep it off the event loop
+    try:
+        result = await run_cpu(_match_gallery, read_ciphertext(await file.read()))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ciphertext_response(request, result)
@@ -0,0 +1,185 @@
+import logging
+import os
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from storage.segment_store import SegmentStore
+
+load_dotenv()
+GALLERY_DIR = "storage/gallery"
+# Single-file gallery written by earlier versions; imported once, then renamed to *.imported
+LEGACY_GALLERY_PATH = "storage/gallery.npz"
+# Widest template the gallery accepts; a matmul costs ~dim rotations, so project 4096-dim VGG-Face first
+GALLERY_MAX_DIM = int(os.getenv("GALLERY_MAX_DIM", "512"))
+
+logger = logging.getLogger(__name__)
+
+
+class PlainGallery:
+    """
+    1:N gallery of L2-normalized float32 templates kept as one plaintext (N, dim) matrix.
+
+    An encrypted probe is scored against the whole gallery with a single
+    encrypted vector-matrix product per `slots` users, so the result is one
+    ciphertext holding every score instead of one ciphertext per user.
+
+    Templates are persisted as one appended record each in a SegmentStore; the
+    in-memory matrix grows by doubling, so an add costs O(dim), not O(N * dim).
+    Every API worker holds its own matrix; before each operation it applies the
+    templates other workers added or removed since it last looked at the store.
+    """
+
+    def __init__(self, directory=GALLERY_DIR, legacy_path=LEGACY_GALLERY_PATH, max_dim=GALLERY_MAX_DIM):
+        self.store = SegmentStore(directory)
+        self.max_dim = max_dim
+        self._lock = threading.Lock()
+        self._user_ids = []
+        self._index = {}
+        self._versions = {}  # user_id -> store version of the row in the matrix
+        self._generation = None  # store generation the matrix reflects
+        self._matrix = None  # rows [0, len(self._user_ids)) are live
+        self._import_legacy(legacy_path)
+        with self._lock:
+            self._refresh()
+
+    def _import_legacy(self, path):
+        # Every worker builds a gallery; the store lock lets only one of them import the file
+        with self.store.locked():
+            try:
+                with np.load(path, allow_pickle=False) as data:
+                    user_ids, matrix = [str(u) for u in data["user_ids"]], data["matrix"]
+            except FileNotFoundError:
+                return
+            imported = 0
+            for user_id, row in zip(user_ids, matrix):
+                if user_id in self.store:
+                    continue
+                try:
+                    self.add(user_id, row)
+                    imported += 1
+                except ValueError as e:
+                    logger.warning(f"Skipping legacy gallery template of user {user_id}: {e}")
+            os.replace(path, path + ".imported")
+            logger.info(f"Imported {imported} of {len(user_ids)} gallery templates from {path}")
+
+    def _refresh(self):
+        # Caller holds self._lock
+        with self.store.locked():
+            generation = self.store.generation()
+            if generation == self._generation:
+                return
+            versions = self.store.versions()
+            for user_id in [u for u in self._versions if u not in versions]:
+                self._remove_row(user_id)
+            for user_id, version in versions.items():
+                if self._versions.get(user_id) != version:
+                    payload = self.store.get(user_id)[1]
+                    self._set_row(user_id, np.frombuffer(payload, dtype=np.float32), version)
+            self._generation = generation
+
+    def _set_row(self, user_id, embedding, version):
+        self._versions[user_id] = version
+        if user_id in self._index:
+            self._matrix[self._index[user_id]] = embedding
+            return
+        count = len(self._user_ids)
+        if self._matrix is None:
+            self._matrix = np.empty((64, embedding.size), dtype=np.float32)
+        elif count == len(self._matrix):
+            grown = np.empty((2 * count, self._matrix.shape[1]), dtype=np.float32)
+            grown[:count] = self._matrix
+            self._matrix = grown
+        self._matrix[count] = embedding
+        self._index[user_id] = count
+        self._user_ids.append(user_id)
+
+    def _remove_row(self, user_id):
+        # Move the last row into the freed one instead of shifting the whole matrix
+        del self._versions[user_id]
+        row, last = self._index.pop(user_id), len(self._user_ids) - 1
+        last_user = self._user_ids.pop()
+        if row != last:
+            self._matrix[row] = self._matrix[last]
+            self._user_ids[row] = last_user
+            self._index[last_user] = row
+        if not self._user_ids:
+            self._matrix = None
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._user_ids)
+
+    @property
+    def dim(self):
+        return None if self._matrix is None else self._matrix.shape[1]
+
+    def add(self, user_id, embedding):
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if embedding.size > self.max_dim:
+            raise ValueError(
+                f"Template has {embedding.size} dims but the gallery accepts at most {self.max_dim} "
+                f"(GALLERY_MAX_DIM); fit a projection with `python -m utils.projection fit` so uploads "
+                f"are projected to its output width"
+            )
+        norm = np.linalg.norm(embedding)
+        if norm == 0:
+            raise ValueError("Template embedding is all zeros")
+        embedding = embedding / norm
+
+        with self._lock, self.store.locked():
+            self._refresh()
+            if self._user_ids and embedding.size != self.dim:
+                raise ValueError(
+                    f"Template has {embedding.size} dims but the gallery holds {self.dim}-dim templates"
+                )
+            self._set_row(user_id, embedding, self.store.put(user_id, embedding.tobytes()))
+            self._generation = self.store.generation()
+
+    def remove(self, user_id):
+        with self._lock, self.store.locked():
+            self._refresh()
+            if user_id not in self._index:
+                return False
+            self.store.delete(user_id)
+            self._remove_row(user_id)
+            self._generation = self.store.generation()
+            return True
+
+    def match(self, enc_probe, slots):
+        """
+        Score an encrypted probe against every template.
+
+        Returns a list of (ciphertext, user_ids) pairs; each ciphertext holds the
+        scores of up to `slots` users in the same order as its user_ids.
+        """
+        with self._lock:
+            self._refresh()
+            if not self._user_ids:
+                return []
+            # Copy, since add/remove rewrite rows in place
+            matrix, user_ids = self._matrix[:len(self._user_ids)].copy(), list(self._user_ids)
+        if enc_probe.size() != matrix.shape[1]:
+            raise ValueError(
+                f"Probe has {enc_probe.size()} dims but the gallery holds {matrix.shape[1]}-dim templates"
+            )
+
+        chunks = []
+        for start in range(0, len(user_ids), slots):
+            # (dim, n) column block: probe @ block gives n scores in one ciphertext
+            block = matrix[start:start + slots].T
+            chunks.append((enc_probe.matmul(block.tolist()), user_ids[start:start + slots]))
+        return chunks
+
+
+_gallery = None
+_gallery_lock = threading.Lock()
+
+
+def get_gallery():
+    """The process-wide gallery, loaded on first use so only GALLERY_MATCHING deployments pay for it."""
+    global _gallery
+    with _gallery_lock:
+        if _gallery is None:
+            _gallery = PlainGallery()
+        return _gallery
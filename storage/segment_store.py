@@ -0,0 +1,495 @@
+import hashlib
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Append-only segment files hold the templates:
+#
+#   record = magic "EMBR" | flags u8 | key_len u16 | payload_len u32 | version u64 | crc32 u32
+#            | user_id (key_len bytes) | payload (payload_len bytes)
+#
+# A delete appends a tombstone record (FLAG_TOMBSTONE, empty payload), an overwrite
+# appends a new record; the newest record for a user_id wins. Segments are the source
+# of truth and roll over at SEGMENT_MAX_BYTES.
+#
+# index.bin maps user_ids to record locations and is read through mmap:
+#
+#   header = magic "EMBIDX01" | count u64 | checkpoint_segment u32 | checkpoint_offset u64 | next_version u64
+#   keys   = count x u64, sorted (first 8 bytes of blake2b(user_id))
+#   slots  = count x (segment u32, length u32, offset u64, version u64, name_offset u64, name_len u32, pad u32)
+#   names  = UTF-8 user_ids, addressed by name_offset / name_len
+#
+# Lookups binary-search the mmap'd key column. Writes since the last index rewrite live
+# in an in-memory delta; on open, segment data past the checkpoint is replayed into it.
+#
+# Several processes (API workers) may open the same directory. Every operation holds an
+# exclusive flock on store.lock and first catches up with the others: a rewritten
+# index.bin (flush or compaction by another process) is re-mapped, then records appended
+# past the last position this process has seen are replayed into the delta.
+
+RECORD_MAGIC = b"EMBR"
+RECORD_HEADER = struct.Struct("<4sBHIQI")
+FLAG_TOMBSTONE = 0x01
+
+INDEX_MAGIC = b"EMBIDX01"
+INDEX_HEADER = struct.Struct("<8sQIQQ")
+SLOT_DTYPE = np.dtype([
+    ("segment", "<u4"), ("length", "<u4"), ("offset", "<u8"), ("version", "<u8"),
+    ("name_offset", "<u8"), ("name_len", "<u4"), ("pad", "<u4"),
+])
+
+SEGMENT_MAX_BYTES = int(os.getenv("EMBEDDINGS_SEGMENT_MAX_BYTES", 256 * 2**20))
+INDEX_FLUSH_ENTRIES = int(os.getenv("EMBEDDINGS_INDEX_FLUSH_ENTRIES", 4096))
+COMPACT_MIN_BYTES = int(os.getenv("EMBEDDINGS_COMPACT_MIN_BYTES", 64 * 2**20))
+FSYNC = os.getenv("EMBEDDINGS_FSYNC", "true").lower() in ("1", "true", "yes")
+
+_SEGMENT_NAME = re.compile(r"^seg-(\d{8})\.dat$")
+
+
+def user_key(user_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(user_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class SegmentStore:
+    """
+    Template store on append-only segment files with an mmap'd offset index.
+
+    put/delete are atomic (a single appended record, then an in-memory pointer swap),
+    compact() rewrites only live records, and iter_items() streams every live template
+    in one sequential pass over the segments. Safe to share between processes.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, "index.bin")
+        self._lock = threading.RLock()
+        self._lock_file = open(os.path.join(directory, "store.lock"), "a")
+        self._lock_depth = 0
+        self._index_signature = None  # (inode, mtime, size) of the index.bin that is mapped
+        self._tail = (0, 0)  # (segment, offset) up to which segment data has been applied
+        self._readers = {}
+        self._writer = None
+        self._writer_segment = None
+        self._index_file = None
+        self._index_mmap = None
+        self._keys = np.empty(0, dtype="<u8")
+        self._slots = np.empty(0, dtype=SLOT_DTYPE)
+        self._delta = {}  # user_id -> (segment, offset, length, version) or None for deleted
+        self._next_version = 1
+        self._live_bytes = 0
+        self._open()
+
+    # ----- files -----
+
+    def _segment_path(self, segment_id):
+        return os.path.join(self.directory, f"seg-{segment_id:08d}.dat")
+
+    def _segment_ids(self):
+        ids = []
+        for name in os.listdir(self.directory):
+            match = _SEGMENT_NAME.match(name)
+            if match:
+                ids.append(int(match.group(1)))
+        return sorted(ids)
+
+    def _reader(self, segment_id):
+        fd = self._readers.get(segment_id)
+        if fd is None:
+            fd = os.open(self._segment_path(segment_id), os.O_RDONLY)
+            self._readers[segment_id] = fd
+        return fd
+
+    def _close_readers(self):
+        for fd in self._readers.values():
+            os.close(fd)
+        self._readers = {}
+
+    def _open_writer(self, segment_id):
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = open(self._segment_path(segment_id), "ab")
+        self._writer_segment = segment_id
+
+    # ----- index -----
+
+    def _map_index(self):
+        if self._index_mmap is not None:
+            self._keys = self._slots = None
+            self._index_mmap.close()
+            self._index_file.close()
+            self._index_mmap = self._index_file = None
+
+        if not os.path.exists(self.index_path) or os.path.getsize(self.index_path) == 0:
+            self._keys = np.empty(0, dtype="<u8")
+            self._slots = np.empty(0, dtype=SLOT_DTYPE)
+            return 0, 0, 1
+
+        self._index_file = open(self.index_path, "rb")
+        self._index_mmap = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, checkpoint_segment, checkpoint_offset, next_version = INDEX_HEADER.unpack_from(
+            self._index_mmap, 0
+        )
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{self.index_path} is not an embeddings index")
+        self._keys = np.frombuffer(self._index_mmap, dtype="<u8", count=count, offset=INDEX_HEADER.size)
+        self._slots = np.frombuffer(
+            self._index_mmap, dtype=SLOT_DTYPE, count=count, offset=INDEX_HEADER.size + 8 * count
+        )
+        self._names_base = INDEX_HEADER.size + (8 + SLOT_DTYPE.itemsize) * count
+        return checkpoint_segment, checkpoint_offset, next_version
+
+    def _write_index(self, entries, checkpoint_segment, checkpoint_offset):
+        """Atomically replace index.bin with `entries`: iterable of (user_id, (segment, offset, length, version))."""
+        rows = sorted((user_key(user_id), user_id.encode("utf-8"), loc) for user_id, loc in entries)
+        keys = np.array([key for key, _, _ in rows], dtype="<u8")
+        slots = np.zeros(len(rows), dtype=SLOT_DTYPE)
+        names, name_offset = [], 0
+        for i, (_, name, (segment, offset, length, version)) in enumerate(rows):
+            slots[i] = (segment, length, offset, version, name_offset, len(name), 0)
+            names.append(name)
+            name_offset += len(name)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(rows), checkpoint_segment, checkpoint_offset, self._next_version))
+            f.write(keys.tobytes())
+            f.write(slots.tobytes())
+            f.write(b"".join(names))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+        self._map_index()
+        self._index_signature = self._read_index_signature()
+        self._tail = (checkpoint_segment, checkpoint_offset)
+
+    def _read_index_signature(self):
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _index_entry(self, i):
+        slot = self._slots[i]
+        start = self._names_base + int(slot["name_offset"])
+        user_id = bytes(self._index_mmap[start:start + int(slot["name_len"])]).decode("utf-8")
+        return user_id, (int(slot["segment"]), int(slot["offset"]), int(slot["length"]), int(slot["version"]))
+
+    def _index_lookup(self, user_id):
+        key = user_key(user_id)
+        i = int(np.searchsorted(self._keys, key, side="left"))
+        # 64-bit keys can collide, so confirm against the stored user_id
+        while i < len(self._keys) and self._keys[i] == key:
+            name, loc = self._index_entry(i)
+            if name == user_id:
+                return loc
+            i += 1
+        return None
+
+    def _index_entries(self):
+        """(user_id, location) for every entry of the mmap'd index."""
+        for i in range(len(self._keys)):
+            yield self._index_entry(i)
+
+    # ----- records -----
+
+    def _encode_record(self, user_id, payload, version, flags=0):
+        key = user_id.encode("utf-8")
+        crc = zlib.crc32(key + payload)
+        return RECORD_HEADER.pack(RECORD_MAGIC, flags, len(key), len(payload), version, crc) + key + payload
+
+    def _read_record(self, loc):
+        segment, offset, length, _ = loc
+        raw = os.pread(self._reader(segment), length, offset)
+        magic, _, key_len, payload_len, _, crc = RECORD_HEADER.unpack_from(raw, 0)
+        body = raw[RECORD_HEADER.size:]
+        if magic != RECORD_MAGIC or len(body) != key_len + payload_len or zlib.crc32(body) != crc:
+            raise IOError(f"Corrupt record in segment {segment} at offset {offset}")
+        return body[:key_len].decode("utf-8"), body[key_len:]
+
+    def _scan_segment(self, segment_id, start=0, end=None, repair=False, f=None):
+        """
+        Yield (offset, length, flags, version, user_id, payload) sequentially up to `end`.
+        With repair=True (only under the store lock) a torn tail is truncated. `f` is an
+        already open handle on the segment, which stays readable if it is compacted away.
+        """
+        path = self._segment_path(segment_id)
+        with (f or open(path, "rb", buffering=1024 * 1024)) as f:
+            f.seek(start)
+            offset = start
+            while end is None or offset < end:
+                header = f.read(RECORD_HEADER.size)
+                if not header:
+                    return
+                if len(header) < RECORD_HEADER.size:
+                    break
+                magic, flags, key_len, payload_len, version, crc = RECORD_HEADER.unpack(header)
+                body = f.read(key_len + payload_len)
+                if magic != RECORD_MAGIC or len(body) != key_len + payload_len or zlib.crc32(body) != crc:
+                    break
+                length = RECORD_HEADER.size + len(body)
+                yield offset, length, flags, version, body[:key_len].decode("utf-8"), body[key_len:]
+                offset += length
+            else:
+                return
+        if not repair:
+            raise IOError(f"Corrupt record in {path} at offset {offset}")
+        # A crash mid-append leaves a partial record; drop it so later appends stay readable
+        logger.warning(f"Truncating torn record at {path}:{offset}")
+        with open(path, "r+b") as f:
+            f.truncate(offset)
+
+    # ----- lifecycle -----
+
+    def _open(self):
+        with self.locked():
+            pass  # locking replays everything appended after the index was last written
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold the store exclusively, across threads and processes, caught up with every
+        write made so far; e.g. to keep a one-off migration from running twice.
+        """
+        with self._lock:
+            if self._lock_depth == 0:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+                try:
+                    self._sync()
+                except BaseException:
+                    self._unlock()
+                    raise
+            self._lock_depth += 1
+            try:
+                yield self
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    self._unlock()
+
+    def _unlock(self):
+        if fcntl is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """Catch up with writes made by other processes since this one last held the lock."""
+        signature = self._read_index_signature()
+        if signature != self._index_signature:
+            # index.bin was rewritten (flush or compaction): it holds everything up to its checkpoint
+            checkpoint_segment, checkpoint_offset, next_version = self._map_index()
+            self._index_signature = signature
+            self._next_version = max(self._next_version, next_version)
+            self._live_bytes = int(self._slots["length"].sum()) if len(self._slots) else 0
+            self._delta = {}
+            self._close_readers()
+            self._tail = (checkpoint_segment, checkpoint_offset)
+
+        segment_ids = self._segment_ids()
+        for segment_id in segment_ids:
+            if segment_id < self._tail[0]:
+                continue
+            end = self._tail[1] if segment_id == self._tail[0] else 0
+            for offset, length, flags, version, user_id, _ in self._scan_segment(segment_id, end, repair=True):
+                self._apply(user_id, None if flags & FLAG_TOMBSTONE else (segment_id, offset, length, version))
+                self._next_version = max(self._next_version, version + 1)
+                end = offset + length
+            self._tail = (segment_id, end)
+
+        last_segment = segment_ids[-1] if segment_ids else max(self._tail[0], 1)
+        if self._writer_segment != last_segment:
+            self._open_writer(last_segment)
+
+    def close(self):
+        with self.locked():
+            if self._delta:
+                self.flush_index()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self._close_readers()
+            if self._index_mmap is not None:
+                self._keys = self._slots = None
+                self._index_mmap.close()
+                self._index_file.close()
+                self._index_mmap = self._index_file = None
+        self._lock_file.close()
+
+    # ----- public API -----
+
+    def _locate(self, user_id):
+        if user_id in self._delta:
+            return self._delta[user_id]
+        return self._index_lookup(user_id)
+
+    def _apply(self, user_id, loc):
+        previous = self._locate(user_id)
+        if previous is not None:
+            self._live_bytes -= previous[2]
+        if loc is not None:
+            self._live_bytes += loc[2]
+        self._delta[user_id] = loc
+
+    def _append(self, record, sync=FSYNC):
+        # Other processes append to the same segment, so the handle's position may be stale
+        self._writer.seek(0, os.SEEK_END)
+        if self._writer.tell() + len(record) > SEGMENT_MAX_BYTES and self._writer.tell() > 0:
+            if not sync:
+                os.fsync(self._writer.fileno())
+            self._open_writer(self._writer_segment + 1)
+        offset = self._writer.tell()
+        self._writer.write(record)
+        self._writer.flush()
+        if sync:
+            os.fsync(self._writer.fileno())
+        self._tail = (self._writer_segment, offset + len(record))
+        return self._writer_segment, offset
+
+    def put(self, user_id, payload):
+        """Store (or atomically replace) a template; returns its new version."""
+        with self.locked():
+            version = self._next_version
+            self._next_version += 1
+            record = self._encode_record(user_id, payload, version)
+            segment, offset = self._append(record)
+            self._apply(user_id, (segment, offset, len(record), version))
+            self._after_write()
+            return version
+
+    def delete(self, user_id):
+        with self.locked():
+            if self._locate(user_id) is None:
+                return False
+            version = self._next_version
+            self._next_version += 1
+            self._append(self._encode_record(user_id, b"", version, FLAG_TOMBSTONE))
+            self._apply(user_id, None)
+            self._after_write()
+            return True
+
+    def get(self, user_id):
+        """(version, payload) for a user_id; raises KeyError if it is not stored."""
+        with self.locked():
+            loc = self._locate(user_id)
+            if loc is None:
+                raise KeyError(user_id)
+            return loc[3], self._read_record(loc)[1]
+
+    def version(self, user_id):
+        with self.locked():
+            loc = self._locate(user_id)
+            return None if loc is None else loc[3]
+
+    def generation(self):
+        """Changes on every put/delete by any process; compare values to detect outside writes."""
+        with self.locked():
+            return self._next_version
+
+    def versions(self):
+        """{user_id: version} of every live template."""
+        with self.locked():
+            return {user_id: loc[3] for user_id, loc in self._live_locations().items()}
+
+    def __contains__(self, user_id):
+        return self.version(user_id) is not None
+
+    def _live_locations(self):
+        """Current (user_id, location) of every live template."""
+        entries = {user_id: loc for user_id, loc in self._index_entries() if user_id not in self._delta}
+        entries.update((user_id, loc) for user_id, loc in self._delta.items() if loc is not None)
+        return entries
+
+    def user_ids(self):
+        with self.locked():
+            return list(self._live_locations())
+
+    def __len__(self):
+        return len(self.user_ids())
+
+    def iter_items(self):
+        """
+        Stream (user_id, version, payload) for every live template in one sequential
+        pass over the segment files, e.g. for gallery-wide matching.
+        """
+        with self.locked():
+            live = {(loc[0], loc[1]) for loc in self._live_locations().values()}
+            # Appends after this point are not part of the snapshot
+            end = self._tail
+            # Opened now, so a compaction by another process can't remove them mid-scan
+            files = [
+                (segment_id, open(self._segment_path(segment_id), "rb", buffering=1024 * 1024))
+                for segment_id in self._segment_ids() if segment_id <= end[0]
+            ]
+
+        try:
+            for segment_id, f in files:
+                stop = end[1] if segment_id == end[0] else None
+                for offset, _, flags, version, user_id, payload in self._scan_segment(segment_id, end=stop, f=f):
+                    if (segment_id, offset) in live:
+                        yield user_id, version, payload
+        finally:
+            for _, f in files:
+                f.close()
+
+    def flush_index(self):
+        """Fold the in-memory delta into a fresh sorted index.bin."""
+        with self.locked():
+            self._write_index(self._live_locations().items(), *self._tail)
+            self._delta = {}
+
+    def _after_write(self):
+        if len(self._delta) >= INDEX_FLUSH_ENTRIES:
+            self.flush_index()
+        garbage = self._total_bytes() - self._live_bytes
+        if garbage > max(COMPACT_MIN_BYTES, self._live_bytes):
+            self.compact()
+
+    def _total_bytes(self):
+        return sum(os.path.getsize(self._segment_path(s)) for s in self._segment_ids())
+
+    def compact(self):
+        """Rewrite live templates into fresh segments and drop the old ones."""
+        with self.locked():
+            old_segments = self._segment_ids()
+            live = sorted(self._live_locations().items(), key=lambda item: (item[1][0], item[1][1]))
+            self._open_writer((old_segments[-1] if old_segments else 0) + 1)
+
+            entries = []
+            for user_id, loc in live:
+                _, payload = self._read_record(loc)
+                record = self._encode_record(user_id, payload, loc[3])
+                # One fsync per segment for the whole rewrite instead of one per record
+                segment, offset = self._append(record, sync=False)
+                entries.append((user_id, (segment, offset, len(record), loc[3])))
+            os.fsync(self._writer.fileno())
+
+            self._write_index(entries, self._writer_segment, self._writer.tell())
+            self._delta = {}
+            self._close_readers()
+            for segment_id in old_segments:
+                os.remove(self._segment_path(segment_id))
+            self._live_bytes = sum(loc[2] for _, loc in entries)
+            logger.info(f"Compacted {len(old_segments)} segments into {len(entries)} live templates")
+
+    def stats(self):
+        with self.locked():
+            return {
+                "segments": len(self._segment_ids()),
+                "total_bytes": self._total_bytes(),
+                "live_bytes": self._live_bytes,
+                "indexed_entries": len(self._keys),
+                "pending_index_entries": len(self._delta),
+            }
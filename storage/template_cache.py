@@ -0,0 +1,99 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+TEMPLATE_CACHE_BYTES = int(os.getenv("TEMPLATE_CACHE_BYTES", 256 * 2**20))
+
+logger = logging.getLogger(__name__)
+
+
+def ciphertext_nbytes(vector):
+    """In-memory size of a CKKSVector: polys x degree x RNS limbs x 8-byte coefficients."""
+    return sum(
+        ct.size() * ct.poly_modulus_degree() * ct.coeff_modulus_size() * 8
+        for ct in vector.ciphertext()
+    )
+
+
+class TemplateCache:
+    """
+    LRU cache of deserialized, context-linked template CKKSVectors keyed by
+    (user_id, version), bounded by their in-memory size.
+
+    Vectors are only read by the compare path (every operation returns a new
+    vector), so one cached instance can be shared between concurrent requests.
+    """
+
+    def __init__(self, max_bytes=TEMPLATE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (user_id, version) -> (vector, nbytes)
+        self._context = None
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _check_context(self, context):
+        # Vectors are linked to one context object; a reloaded context invalidates all of them
+        if context is not self._context:
+            self._entries.clear()
+            self._bytes = 0
+            self._context = context
+
+    def get(self, user_id, version, context):
+        with self._lock:
+            self._check_context(context)
+            entry = self._entries.get((user_id, version))
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((user_id, version))
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user_id, version, vector, context):
+        nbytes = ciphertext_nbytes(vector)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            self._check_context(context)
+            self._remove_user(user_id)
+            self._entries[(user_id, version)] = (vector, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def _remove_user(self, user_id):
+        for key in [key for key in self._entries if key[0] == user_id]:
+            self._bytes -= self._entries.pop(key)[1]
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._remove_user(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+
+
+template_cache = TemplateCache()
@@ -0,0 +1,37 @@
+import numpy as np
+from storage.gallery import PlainGallery
+
+
+def _rows(gallery):
+    with gallery._lock:
+        gallery._refresh()
+        return {user_id: gallery._matrix[row].copy() for user_id, row in gallery._index.items()}
+
+
+def test_two_workers_see_each_others_templates(tmp_path):
+    # Two API workers, each with its own in-memory matrix over the same store
+    legacy = str(tmp_path / "gallery.npz")
+    a = PlainGallery(str(tmp_path / "gallery"), legacy_path=legacy)
+    b = PlainGallery(str(tmp_path / "gallery"), legacy_path=legacy)
+    a.add("alice", [3.0, 4.0])
+    b.add("bob", [0.0, 2.0])
+    assert len(a) == len(b) == 2
+    np.testing.assert_allclose(_rows(a)["bob"], [0.0, 1.0])
+
+    # An overwrite and a removal in one worker reach the other
+    b.add("alice", [1.0, 0.0])
+    a.remove("bob")
+    rows = _rows(b)
+    assert sorted(rows) == ["alice"]
+    np.testing.assert_allclose(rows["alice"], [1.0, 0.0])
+    assert not b.remove("bob")
+
+
+def test_legacy_file_is_imported_once(tmp_path):
+    legacy = tmp_path / "gallery.npz"
+    np.savez(legacy, user_ids=np.array(["alice", "bob"]), matrix=np.eye(2, dtype=np.float32))
+    a = PlainGallery(str(tmp_path / "gallery"), legacy_path=str(legacy))
+    a.remove("bob")
+    b = PlainGallery(str(tmp_path / "gallery"), legacy_path=str(legacy))
+    assert sorted(_rows(b)) == ["alice"]
+    assert (tmp_path / "gallery.npz.imported").exists()
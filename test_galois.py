@@ -0,0 +1,35 @@
+import tenseal as ts
+from utils.galois import _proto_encode, _proto_fields, lean_public_context, naf, rotation_steps
+from utils.tenseal_context import create_context
+
+
+def test_naf_terms_sum_to_the_step_and_are_non_adjacent():
+    for value in list(range(-300, 300)) + [4095]:
+        terms = naf(value)
+        assert sum(terms) == value
+        bits = sorted(abs(t).bit_length() for t in terms)
+        assert all(b - a >= 2 for a, b in zip(bits, bits[1:]))
+
+
+def test_rotation_steps_per_kernel():
+    assert rotation_steps(8, 4096, ["dot"]) == [1, 2, 4]
+    assert rotation_steps(5, 4096, ["dot"]) == [1, 2, 4]
+    assert rotation_steps(8, 4096, ["dot", "matmul"]) == [-2, -1, 1, 2, 4, 8]  # 3 = 4 - 1, 6 = 8 - 2, 7 = 8 - 1
+
+
+def test_protobuf_fields_reencode_byte_for_byte():
+    context = create_context("compact", galois_keys=False)
+    context.make_context_public()
+    data = context.serialize()
+    assert _proto_encode(_proto_fields(data)) == data
+
+
+def test_lean_public_context_holds_working_keys_for_its_steps():
+    secret = create_context("compact", galois_keys=False)
+    public = ts.context_from(lean_public_context(secret, rotation_steps(16, 4096, ["dot"])))
+    assert public.has_galois_keys() and not public.has_secret_key()
+
+    a, b = [0.5] * 16, [2.0] * 16
+    enc = ts.ckks_vector(public, a).dot(ts.ckks_vector(public, b))
+    enc.link_context(secret)
+    assert abs(enc.decrypt()[0] - 16.0) < 1e-2
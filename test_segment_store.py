@@ -0,0 +1,133 @@
+import multiprocessing
+import os
+from storage.segment_store import SegmentStore
+
+
+def test_put_get_delete_roundtrip(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    v1 = store.put("alice", b"template-1")
+    v2 = store.put("bob", b"template-2")
+    assert v2 > v1
+    assert store.get("alice") == (v1, b"template-1")
+    assert "bob" in store and len(store) == 2
+
+    # An overwrite gets a new version, a delete leaves nothing behind
+    v3 = store.put("alice", b"template-3")
+    assert store.get("alice") == (v3, b"template-3")
+    assert store.delete("bob")
+    assert not store.delete("bob")
+    assert "bob" not in store and store.version("bob") is None
+    assert sorted(store.iter_items()) == [("alice", v3, b"template-3")]
+    store.close()
+
+
+def test_reopen_replays_writes_after_the_index_checkpoint(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    store.put("alice", b"a1")
+    store.put("bob", b"b1")
+    store.flush_index()
+    # Past the checkpoint: only in the segment file until the index is rewritten
+    store.put("alice", b"a2")
+    store.delete("bob")
+    store.put("carol", b"c1")
+
+    # Reopen without close(), as after a crash
+    reopened = SegmentStore(str(tmp_path))
+    assert reopened.get("alice")[1] == b"a2"
+    assert "bob" not in reopened
+    assert reopened.get("carol")[1] == b"c1"
+    assert sorted(reopened.user_ids()) == ["alice", "carol"]
+    # Versions keep increasing after the replay
+    assert reopened.put("dave", b"d1") > store.version("carol")
+    reopened.close()
+
+
+def test_reopen_truncates_a_torn_record(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    store.put("alice", b"a1")
+    store.close()
+    segment = store._segment_path(store._segment_ids()[-1])
+    with open(segment, "ab") as f:
+        f.write(b"EMBR\x00\x05")  # partial header of an interrupted append
+
+    reopened = SegmentStore(str(tmp_path))
+    assert reopened.get("alice")[1] == b"a1"
+    reopened.put("bob", b"b1")
+    reopened.close()
+    assert SegmentStore(str(tmp_path)).get("bob")[1] == b"b1"
+
+
+def test_compact_keeps_only_live_records(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    for i in range(50):
+        store.put("alice", f"a{i}".encode())
+        store.put(f"user-{i}", b"x" * 100)
+    for i in range(0, 50, 2):
+        store.delete(f"user-{i}")
+    versions = {user_id: store.version(user_id) for user_id in store.user_ids()}
+    before = store.stats()["total_bytes"]
+
+    store.compact()
+    stats = store.stats()
+    assert stats["total_bytes"] < before
+    assert stats["total_bytes"] == stats["live_bytes"]
+    assert stats["pending_index_entries"] == 0
+    assert {user_id: store.version(user_id) for user_id in store.user_ids()} == versions
+    assert store.get("alice")[1] == b"a49"
+    store.close()
+
+    reopened = SegmentStore(str(tmp_path))
+    assert len(reopened) == 26
+    assert "user-0" not in reopened and reopened.get("user-1")[1] == b"x" * 100
+    assert [name for name in os.listdir(tmp_path) if name.startswith("seg-")] == ["seg-00000002.dat"]
+    reopened.close()
+
+
+def test_two_instances_see_each_others_writes(tmp_path):
+    # Two API workers opening the same directory
+    a, b = SegmentStore(str(tmp_path)), SegmentStore(str(tmp_path))
+    a.put("alice", b"a1")
+    b.put("bob", b"b1")
+    b.flush_index()  # alice was appended before b's checkpoint; she must be in b's index
+    assert sorted(SegmentStore(str(tmp_path)).user_ids()) == ["alice", "bob"]
+    assert a.get("bob")[1] == b"b1"
+
+    a.put("bob", b"b2")
+    assert b.get("bob")[1] == b"b2"
+    assert b.version("bob") > b.version("alice")
+    b.delete("alice")
+    assert "alice" not in a
+
+    # Compaction by one instance moves the records the other one points at
+    a.compact()
+    assert b.get("bob")[1] == b"b2"
+    b.put("carol", b"c1")
+    assert sorted(item[0] for item in a.iter_items()) == ["bob", "carol"]
+    a.close()
+    b.close()
+    assert sorted(SegmentStore(str(tmp_path)).user_ids()) == ["bob", "carol"]
+
+
+def _put_many(directory, prefix, count):
+    store = SegmentStore(directory)
+    for i in range(count):
+        store.put(f"{prefix}-{i}", prefix.encode() * 10)
+        if i % 16 == 0:
+            store.flush_index()
+    store.close()
+
+
+def test_concurrent_processes_lose_no_writes(tmp_path):
+    processes = [
+        multiprocessing.get_context("fork").Process(target=_put_many, args=(str(tmp_path), prefix, 100))
+        for prefix in ("a", "b", "c")
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    store = SegmentStore(str(tmp_path))
+    assert len(store) == 300
+    assert store.get("b-99")[1] == b"b" * 10
+    store.close()
@@ -0,0 +1,83 @@
+import random
+import lz4.frame
+import pytest
+from starlette.requests import Request
+from utils.wire_format import (
+    FLAG_LZ4, MAGIC, MAX_FRAME_BYTES, VERSION, _FRAME, _HEADER, decode_frames, encode_frames, read_ciphertext,
+    wants_binary, wants_lz4,
+)
+
+
+def _request(**headers):
+    return Request({"type": "http", "headers": [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()]})
+
+
+def test_framed_payload_roundtrip():
+    payload = {"ciphertexts": [b"\x00\x01" * 10, b""], "layout": {"stride": 128}, "nested": [{"enc": b"x"}]}
+    data = encode_frames(payload)
+    magic, version, flags, meta_len, count = _HEADER.unpack_from(data, 0)
+    assert (magic, version, flags, count) == (b"FHEW", 1, 0, 3)
+    assert decode_frames(data) == payload
+
+
+def test_lz4_frames_are_kept_only_when_smaller():
+    compressible, random_like = b"\x00" * 4096, random.Random(0).randbytes(512)
+    data = encode_frames({"a": compressible, "b": random_like}, compress=True)
+    offset = _HEADER.size + _HEADER.unpack_from(data, 0)[3]
+    first_flags, first_len = _FRAME.unpack_from(data, offset)
+    assert first_flags == FLAG_LZ4 and first_len < len(compressible)
+    assert lz4.frame.decompress(data[offset + _FRAME.size:offset + _FRAME.size + first_len]) == compressible
+    second_flags, _ = _FRAME.unpack_from(data, offset + _FRAME.size + first_len)
+    assert second_flags == 0
+    assert decode_frames(data) == {"a": compressible, "b": random_like}
+
+
+def test_read_ciphertext_accepts_raw_and_framed_uploads():
+    assert read_ciphertext(b"raw seal bytes") == b"raw seal bytes"
+    assert read_ciphertext(encode_frames(b"framed", compress=True)) == b"framed"
+    with pytest.raises(ValueError):
+        read_ciphertext(encode_frames({"a": b"1", "b": b"2"}))
+
+
+@pytest.mark.parametrize("cut", [6, _HEADER.size + 3, _HEADER.size + 20, -10])
+def test_truncated_payload_is_rejected(cut):
+    data = encode_frames({"enc": b"x" * 100})
+    with pytest.raises(ValueError):
+        decode_frames(data[:cut])
+
+
+def test_malformed_frames_are_rejected():
+    meta = b'{"enc": {"$frame": 3}}'
+    with pytest.raises(ValueError):
+        decode_frames(_HEADER.pack(MAGIC, VERSION, 0, len(meta), 0) + meta)
+    bomb = lz4.frame.compress(b"\0" * (MAX_FRAME_BYTES + 1))
+    meta = b'{"$frame": 0}'
+    data = _HEADER.pack(MAGIC, VERSION, FLAG_LZ4, len(meta), 1) + meta + _FRAME.pack(FLAG_LZ4, len(bomb)) + bomb
+    with pytest.raises(ValueError):
+        decode_frames(data)
+    garbage = b"not lz4"
+    with pytest.raises(ValueError):
+        decode_frames(data[:_HEADER.size + len(meta)] + _FRAME.pack(FLAG_LZ4, len(garbage)) + garbage)
+
+
+@pytest.mark.parametrize("accept, binary", [
+    ("application/octet-stream", True),
+    ("application/octet-stream, application/json;q=0.9", True),
+    ("application/json, application/octet-stream;q=0.5", False),
+    ("application/octet-stream;q=0", False),
+    ("application/octet-stream; q=0.0, application/json", False),
+    ("*/*", False),
+    ("", False),
+])
+def test_wants_binary_honours_q_values(accept, binary):
+    assert wants_binary(_request(accept=accept)) is binary
+
+
+@pytest.mark.parametrize("encoding, lz4", [
+    ("lz4", True),
+    ("gzip, lz4;q=0.5", True),
+    ("gzip, lz4;q=0", False),
+    ("gzip, br", False),
+])
+def test_wants_lz4_honours_q_values(encoding, lz4):
+    assert wants_lz4(_request(accept_encoding=encoding)) is lz4
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import pytest
+from utils.worker_pool import PoolBusy, WorkerPool
+
+
+def test_admitted_request_is_not_rejected_at_a_later_stage():
+    pool = WorkerPool(workers=1, max_queue=0)
+    release = threading.Event()
+
+    async def request_a(first_done, go_on):
+        await pool.run(lambda: None)  # first stage, admitted on an idle pool
+        first_done.set()
+        await go_on.wait()  # request B holds the only worker by now
+        return await pool.run(lambda: "decrypted")
+
+    async def request_b():
+        return await pool.run(release.wait, 5)
+
+    async def main():
+        first_done, go_on = asyncio.Event(), asyncio.Event()
+        a = asyncio.create_task(request_a(first_done, go_on))
+        await first_done.wait()
+        b = asyncio.create_task(request_b())
+        await asyncio.sleep(0.01)
+        go_on.set()
+        await asyncio.sleep(0.01)
+        # A new request is turned away while B holds the pool ...
+        with pytest.raises(PoolBusy):
+            await pool.run(lambda: None)
+        release.set()
+        # ... but A, admitted earlier, queues its later stage behind B
+        return await a, await b
+
+    assert asyncio.run(main()) == ("decrypted", True)
+    assert pool.stats()["rejected"] == 1
+    pool.shutdown()
+
+
+def test_cancelled_caller_keeps_its_job_counted_until_it_finishes():
+    pool = WorkerPool(workers=1, max_queue=0)
+    release = threading.Event()
+
+    async def main():
+        job = asyncio.create_task(pool.run(release.wait, 5))
+        await asyncio.sleep(0.01)
+        job.cancel()
+        await asyncio.sleep(0.01)
+        # The job still occupies the worker, so the pool is still full
+        with pytest.raises(PoolBusy):
+            await pool.run(lambda: None)
+        release.set()
+        await asyncio.sleep(0.05)
+        return await pool.run(lambda: "ok")
+
+    assert asyncio.run(main()) == "ok"
+    assert pool.stats()["queue_depth"] == 0
+    pool.shutdown()
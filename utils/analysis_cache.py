@@ -0,0 +1,116 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+from prometheus_client import Counter
+
+load_dotenv()
+ANALYSIS_CACHE_TTL = float(os.getenv("ANALYSIS_CACHE_TTL", "300"))
+ANALYSIS_CACHE_BYTES = int(os.getenv("ANALYSIS_CACHE_BYTES", 64 * 2**20))
+
+# Rough per-entry bookkeeping cost (key, dict, facial area) on top of the embedding itself
+ENTRY_OVERHEAD_BYTES = 1024
+
+CACHE_LOOKUPS = Counter("fhe_analysis_cache_lookups", "Face analysis cache lookups", ["result"])
+
+
+def content_key(data: bytes, *parts) -> str:
+    """Hash of the uploaded bytes plus whatever else changes the result (purpose, flags)."""
+    digest = hashlib.blake2b(data, digest_size=20)
+    for part in parts:
+        digest.update(b"\x00" + str(part).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def entry_nbytes(value):
+    embedding = value.get("embedding")
+    nbytes = getattr(embedding, "nbytes", 0)
+    return nbytes + len(value.get("rejected", "")) + ENTRY_OVERHEAD_BYTES
+
+
+class AnalysisCache:
+    """
+    In-memory TTL + LRU cache of plaintext face-analysis results, keyed by a hash of
+    the uploaded image bytes.
+
+    Entries never leave process memory. They expire after `ttl` seconds, and the
+    least recently used ones are evicted once the total exceeds `max_bytes`.
+    A ttl of 0 disables the cache.
+    """
+
+    def __init__(self, ttl=ANALYSIS_CACHE_TTL, max_bytes=ANALYSIS_CACHE_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value, nbytes)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_bytes > 0
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                CACHE_LOOKUPS.labels(result="miss").inc()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_LOOKUPS.labels(result="hit").inc()
+            return entry[1]
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        nbytes = entry_nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (now + self.ttl, value, nbytes)
+            self._bytes += nbytes
+            self._evict(now)
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key)[2]
+
+    def _evict(self, now):
+        # Expired entries first, then least recently used
+        for key in [key for key, entry in self._entries.items() if entry[0] <= now]:
+            self._drop(key)
+        while self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+analysis_cache = AnalysisCache()
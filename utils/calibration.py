@@ -0,0 +1,133 @@
+"""
+Compare CKKS parameter profiles on synthetic embeddings.
+
+    python -m utils.calibration [--profiles compact default] [--dim 4096] [--pairs 50] [--json out.json]
+
+For each profile this reports public-context and ciphertext sizes, encrypt / dot /
+decrypt latency and the error of the decrypted similarity, including how many
+match decisions flip at the verification threshold.
+"""
+import argparse
+import json
+import statistics
+import time
+import numpy as np
+import tenseal as ts
+from utils.tenseal_context import PARAMETER_PROFILES, create_context
+from utils.packing import slot_count
+
+
+def synthetic_pairs(dim, pairs, rng, low=0.3, high=0.8):
+    """
+    Unit-norm, non-negative-ish embedding pairs (like VGG-Face descriptors) whose cosine
+    similarities are spread around the match threshold.
+    """
+    targets = rng.uniform(low, high, size=pairs)
+    probes, templates = [], []
+    for target in targets:
+        a = np.abs(rng.standard_normal(dim))
+        a /= np.linalg.norm(a)
+        noise = rng.standard_normal(dim)
+        noise -= noise.dot(a) * a
+        noise /= np.linalg.norm(noise)
+        b = target * a + np.sqrt(1 - target**2) * noise
+        probes.append(a)
+        templates.append(b)
+    return np.array(probes), np.array(templates)
+
+
+def _ms(samples):
+    return round(statistics.median(samples) * 1000, 3)
+
+
+def calibrate_profile(name, probes, templates, threshold):
+    start = time.perf_counter()
+    context = create_context(name)
+    keygen_seconds = time.perf_counter() - start
+
+    public = context.copy()
+    public.make_context_public()
+    dim = probes.shape[1]
+    report = {
+        "profile": name,
+        **PARAMETER_PROFILES[name],
+        "slot_count": slot_count(context),
+        "keygen_seconds": round(keygen_seconds, 3),
+        "public_context_bytes": len(public.serialize()),
+        "secret_context_bytes": len(context.serialize(save_secret_key=True)),
+    }
+    if dim > report["slot_count"]:
+        report["error"] = f"{dim}-dim embeddings do not fit in {report['slot_count']} slots"
+        return report
+
+    encrypt_t, dot_t, decrypt_t, errors, flips = [], [], [], [], 0
+    ciphertext_bytes = result_bytes = 0
+    for probe, template in zip(probes, templates):
+        enc_template = ts.ckks_vector(context, template)
+        t0 = time.perf_counter()
+        enc_probe = ts.ckks_vector(context, probe)
+        t1 = time.perf_counter()
+        enc_score = enc_probe.dot(enc_template)
+        t2 = time.perf_counter()
+        score = enc_score.decrypt()[0]
+        t3 = time.perf_counter()
+
+        encrypt_t.append(t1 - t0)
+        dot_t.append(t2 - t1)
+        decrypt_t.append(t3 - t2)
+        ciphertext_bytes = len(enc_probe.serialize())
+        result_bytes = len(enc_score.serialize())
+
+        expected = float(probe.dot(template))
+        errors.append(abs(score - expected))
+        if (score > threshold) != (expected > threshold):
+            flips += 1
+
+    report.update({
+        "ciphertext_bytes": ciphertext_bytes,
+        "result_bytes": result_bytes,
+        "encrypt_ms": _ms(encrypt_t),
+        "dot_ms": _ms(dot_t),
+        "decrypt_ms": _ms(decrypt_t),
+        "max_abs_error": float(max(errors)),
+        "mean_abs_error": float(np.mean(errors)),
+        "decision_flips": flips,
+        "pairs": len(errors),
+    })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", default=list(PARAMETER_PROFILES), choices=list(PARAMETER_PROFILES))
+    parser.add_argument("--dim", type=int, default=4096, help="embedding dimension (VGG-Face is 4096)")
+    parser.add_argument("--pairs", type=int, default=50)
+    parser.add_argument("--threshold", type=float, default=0.55)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the reports to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    probes, templates = synthetic_pairs(args.dim, args.pairs, rng)
+
+    reports = []
+    for name in args.profiles:
+        report = calibrate_profile(name, probes, templates, args.threshold)
+        reports.append(report)
+        if "error" in report:
+            print(f"{name:>15}: {report['error']}")
+            continue
+        print(
+            f"{name:>15}: ct={report['ciphertext_bytes'] / 1024:.0f}KiB "
+            f"public={report['public_context_bytes'] / 2**20:.1f}MiB "
+            f"enc={report['encrypt_ms']}ms dot={report['dot_ms']}ms dec={report['decrypt_ms']}ms "
+            f"max_err={report['max_abs_error']:.2e} flips={report['decision_flips']}/{report['pairs']}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,80 @@
+import numpy as np
 from deepface import DeepFace
+from deepface.modules import modeling, preprocessing
 
-def extract_embedding(image_path: str) -> list:
+MODEL_NAME = "VGG-Face"
+DETECTOR_BACKEND = "yunet"
+
+def extract_embedding(img) -> list:
+    # img is a decoded BGR array (or a path); DeepFace accepts both
     embedding_objs = DeepFace.represent(
-        img_path=image_path,
-        model_name="VGG-Face",
+        img_path=img,
+        model_name=MODEL_NAME,
         detector_backend="yunet",
         enforce_detection=True,
         align=True
     )
     if isinstance(embedding_objs, list) and len(embedding_objs) > 0:
         return embedding_objs[0]["embedding"]
-    raise ValueError("No face detected in the image.")
\ No newline at end of file
+    raise ValueError("No face detected in the image.")
+
+def _model_input(model, face):
+    target_size = model.input_shape
+    img = face[:, :, ::-1]  # rgb to bgr, as DeepFace.represent does
+    img = preprocessing.resize_image(img=img, target_size=(target_size[1], target_size[0]))
+    return preprocessing.normalize_input(img=img, normalization="base")  # (1, h, w, 3)
+
+def embed_face(face) -> list:
+    """
+    Embed a face that was already detected and aligned by DeepFace.extract_faces
+    (RGB, scaled to [0, 1]). Applies the same preprocessing DeepFace.represent runs
+    after its own detection, so no second detector pass is needed.
+    """
+    model = DeepFace.build_model(MODEL_NAME)
+    return model.forward(_model_input(model, face))
+
+def embed_faces(faces) -> np.ndarray:
+    """
+    Embed several aligned faces with one batched forward pass of the Keras model.
+    Returns an (n, dim) array of L2-normalized embeddings, as embed_face gives per face.
+    """
+    model = DeepFace.build_model(MODEL_NAME)
+    batch = np.concatenate([_model_input(model, face) for face in faces])
+    embeddings = model.model(batch, training=False).numpy().astype(np.float64)
+    # VGG-Face's forward() L2-normalizes its output; do the same row-wise for the batch
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms)
+
+def _is_no_face_error(e):
+    message = str(e).lower()
+    return "face could not be detected" in message or "no face" in message
+
+def extract_first_face(img):
+    """Detect and align the first face in a decoded BGR image; None if there is none."""
+    try:
+        face_objs = DeepFace.extract_faces(
+            img_path=img,
+            detector_backend=DETECTOR_BACKEND,
+            align=True,
+            anti_spoofing=False
+        )
+    except Exception as e:
+        if _is_no_face_error(e):
+            return None
+        raise
+    return face_objs[0] if face_objs else None
+
+def anti_spoof(img, facial_area):
+    """
+    What DeepFace.extract_faces(anti_spoofing=True) runs per face, kept separate so it
+    is timed on its own. Returns (is_real, score).
+    """
+    model = modeling.build_model(task="spoofing", model_name="Fasnet")
+    area = (facial_area["x"], facial_area["y"], facial_area["w"], facial_area["h"])
+    return model.analyze(img=img, facial_area=area)
+
+def warm_up():
+    """Load the detector, anti-spoofing and recognition models ahead of the first request."""
+    modeling.build_model(task="face_detector", model_name=DETECTOR_BACKEND)
+    modeling.build_model(task="spoofing", model_name="Fasnet")
+    DeepFace.build_model(MODEL_NAME)
@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+import tenseal as ts
+from dotenv import load_dotenv
+from prometheus_client import Counter, Gauge, Histogram
+from utils.packing import slot_count
+
+load_dotenv()
+# Fresh encryptions of zero kept ready per vector length; 0 disables the pool
+ENCRYPT_POOL_SIZE = int(os.getenv("ENCRYPT_POOL_SIZE", "16"))
+# Vector lengths that get a pool, e.g. "4096,256"; empty pools the embedding length (the
+# projection's output length while one is active) and the slot count used by /encrypt-batch.
+# Any other length is encrypted directly, so clients can't make the pool encrypt arbitrary lengths.
+ENCRYPT_POOL_DIMS = [int(d) for d in os.getenv("ENCRYPT_POOL_DIMS", "").split(",") if d.strip()]
+# VGG-Face embedding length
+EMBEDDING_DIM = 4096
+# Refills wait this long after the last request, since TenSEAL holds the GIL while encrypting
+ENCRYPT_POOL_REFILL_DELAY = float(os.getenv("ENCRYPT_POOL_REFILL_DELAY", "0.05"))
+
+logger = logging.getLogger(__name__)
+
+POOL_DEPTH = Gauge("fhe_encrypt_pool_depth", "Pre-encrypted zeros ready for use", ["dim"])
+POOL_REFILLS = Counter("fhe_encrypt_pool_refills", "Zeros encrypted by the background refill worker", ["dim"])
+POOL_REQUESTS = Counter("fhe_encrypt_pool_requests", "Encryptions served from the pool or encrypted directly", ["result"])
+REFILL_SECONDS = Histogram(
+    "fhe_encrypt_pool_refill_seconds", "Time to encrypt one pooled zero",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+
+
+class ZeroEncryptionPool:
+    """
+    Encryption-ahead pool of fresh CKKS encryptions of zero.
+
+    A background thread keeps up to `size` encryptions of an all-zero vector ready
+    for each of the `dims` it is configured with (by default the embedding length and
+    the slot count), up to the context's slot count. `encrypt` pops one and adds the
+    plaintext to it, which costs an encode and an addition instead of a public-key
+    encryption; the sum is an ordinary fresh encryption of the plaintext. Each pooled
+    ciphertext is removed before use, so none is ever handed out twice. When the pool
+    for a length is empty (or full of ciphertexts for a replaced context) the vector is
+    encrypted directly, as is any vector of another length. Refills only run once requests have paused for `refill_delay`,
+    so they don't compete with a burst for the interpreter.
+    """
+
+    def __init__(self, size=ENCRYPT_POOL_SIZE, refill_delay=ENCRYPT_POOL_REFILL_DELAY, dims=ENCRYPT_POOL_DIMS):
+        self.size = size
+        self.dims = list(dims)
+        self.refill_delay = refill_delay
+        self._last_take = 0.0
+        self._cond = threading.Condition()
+        self._context = None
+        self._pools = {}  # dim -> deque of CKKSVectors, set up per context
+        self._thread = None
+        self._stopped = False
+        self.hits = 0
+        self.fallbacks = 0
+        self.refills = 0
+
+    def _use_context(self, context):
+        # Ciphertexts are bound to the context (keys) they were made with
+        if context is not self._context:
+            self._context = context
+            for dim in self._pools:
+                POOL_DEPTH.labels(dim=str(dim)).set(0)
+            self._pools = {dim: deque() for dim in self._pooled_dims(context)}
+
+    def _pooled_dims(self, context):
+        slots = slot_count(context)
+        dims = self.dims
+        if not dims:
+            # Imported here: utils.projection imports utils.tenseal_context, which imports this module
+            from utils.projection import get_projection
+            projection = get_projection()
+            dims = [projection.out_dim if projection is not None else EMBEDDING_DIM, slots]
+        too_long = [dim for dim in dims if not 0 < dim <= slots]
+        if too_long:
+            logger.warning(f"Not pooling vector lengths {too_long}: they don't fit in one {slots}-slot ciphertext")
+        return sorted({dim for dim in dims if 0 < dim <= slots})
+
+    def _take(self, context, dim):
+        with self._cond:
+            self._use_context(context)
+            pool = self._pools.get(dim)
+            zero = pool.popleft() if pool else None
+            self._last_take = time.monotonic()
+            if pool is not None:
+                POOL_DEPTH.labels(dim=str(dim)).set(len(pool))
+                self._cond.notify()
+            if self._thread is None and not self._stopped:
+                self._thread = threading.Thread(target=self._refill_loop, name="encrypt-pool", daemon=True)
+                self._thread.start()
+            return zero
+
+    def encrypt(self, context, vector):
+        """CKKSVector encrypting `vector`, from a pooled zero when one is ready."""
+        values = vector.tolist() if hasattr(vector, "tolist") else list(vector)
+        zero = self._take(context, len(values)) if self.size > 0 else None
+        if zero is None:
+            self.fallbacks += 1
+            POOL_REQUESTS.labels(result="fallback").inc()
+            return ts.ckks_vector(context, values)
+        self.hits += 1
+        POOL_REQUESTS.labels(result="hit").inc()
+        zero.add_(values)
+        return zero
+
+    def _next_refill(self):
+        """(context, dim) of the emptiest pool below target, waiting until there is one."""
+        with self._cond:
+            while not self._stopped:
+                quiet_for = time.monotonic() - self._last_take
+                if quiet_for < self.refill_delay:
+                    self._cond.wait(self.refill_delay - quiet_for)
+                    continue
+                wanted = [(len(pool), dim) for dim, pool in self._pools.items() if len(pool) < self.size]
+                if wanted and self._context is not None:
+                    return self._context, min(wanted)[1]
+                self._cond.wait()
+            return None, None
+
+    def _refill_loop(self):
+        while True:
+            context, dim = self._next_refill()
+            if context is None:
+                return
+            start = time.perf_counter()
+            try:
+                zero = ts.ckks_vector(context, [0.0] * dim)
+            except Exception as e:
+                logger.error(f"Encryption pool refill for dim {dim} failed, encrypting it directly from now on: {e}")
+                with self._cond:
+                    if context is self._context:
+                        self._pools.pop(dim, None)
+                        POOL_DEPTH.labels(dim=str(dim)).set(0)
+                continue
+            REFILL_SECONDS.observe(time.perf_counter() - start)
+            with self._cond:
+                # Dropped if the context was replaced while encrypting
+                if context is self._context and dim in self._pools:
+                    self._pools[dim].append(zero)
+                    POOL_DEPTH.labels(dim=str(dim)).set(len(self._pools[dim]))
+                    self.refills += 1
+                    POOL_REFILLS.labels(dim=str(dim)).inc()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "target_depth": self.size,
+                "depth": {str(dim): len(pool) for dim, pool in self._pools.items()},
+                "hits": self.hits,
+                "fallbacks": self.fallbacks,
+                "refills": self.refills,
+            }
+
+    def shutdown(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+
+zero_pool = ZeroEncryptionPool()
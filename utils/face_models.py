@@ -0,0 +1,41 @@
+"""
+Face model calls for the API: detection, anti-spoofing and embedding.
+
+They run in this process (utils.deepface_utils) unless INFERENCE_SOCKET points at a
+shared inference server (python -m utils.inference_server), in which case one
+process holds the models for every API worker and DeepFace is never imported here.
+The in-process models are imported on first use, so a worker that never handles an
+image never imports DeepFace or TensorFlow.
+"""
+from utils.inference_client import inference_client
+
+_backend = inference_client
+
+
+def load():
+    """The model backend, importing DeepFace (and TensorFlow) if it runs in-process."""
+    global _backend
+    if _backend is None:
+        from utils import deepface_utils
+        _backend = deepface_utils
+    return _backend
+
+
+def extract_first_face(img):
+    return load().extract_first_face(img)
+
+
+def anti_spoof(img, facial_area):
+    return load().anti_spoof(img, facial_area)
+
+
+def embed_face(face) -> list:
+    return load().embed_face(face)
+
+
+def embed_faces(faces):
+    return load().embed_faces(faces)
+
+
+def extract_embedding(img) -> list:
+    return load().extract_embedding(img)
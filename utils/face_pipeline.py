@@ -0,0 +1,257 @@
+import logging
+import os
+import numpy as np
+from utils.face_models import extract_first_face, anti_spoof, embed_face, embed_faces
+from utils.face_utils import check_face_completeness, check_image_quality
+from utils.image_utils import coarsest_reduction, decode_image, decode_working_image
+from utils.analysis_cache import analysis_cache, content_key
+from utils.metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Enrollment frames whose embedding is less similar than this to the medoid frame are dropped
+ENROLL_OUTLIER_THRESHOLD = float(os.getenv("ENROLL_OUTLIER_THRESHOLD", "0.4"))
+TEMPLATE_METHODS = ("mean", "medoid")
+# Streams search for the face within this margin (x its size) around the previous frame's face
+TRACK_MARGIN = float(os.getenv("TRACK_MARGIN", "0.6"))
+# Faces narrower than this (px) in the working image are cropped again from a finer decode
+# of the upload; VGG-Face's input is 224 px
+FACE_CROP_MIN_PX = int(os.getenv("FACE_CROP_MIN_PX", "224"))
+
+NO_FACE_DETAIL = "No face detected in the image. Please ensure your face is clearly visible and try again."
+UNREADABLE_IMAGE_DETAIL = "Failed to read image. Please upload a valid image file."
+
+
+class FaceRejected(Exception):
+    """The image was read fine but the face failed a check; `detail` is user-facing."""
+
+    def __init__(self, detail):
+        super().__init__(detail)
+        self.detail = detail
+
+
+def _anti_spoof(img, face_obj):
+    is_real, score = anti_spoof(img, face_obj["facial_area"])
+    face_obj["is_real"] = is_real
+    face_obj["antispoof_score"] = score
+    return is_real
+
+
+def _search_window(img, area, margin):
+    """Crop box around a previous facial area, grown by `margin` x its size on every side."""
+    height, width = img.shape[:2]
+    x0 = max(0, int(area["x"] - margin * area["w"]))
+    y0 = max(0, int(area["y"] - margin * area["h"]))
+    x1 = min(width, int(area["x"] + (1 + margin) * area["w"]))
+    y1 = min(height, int(area["y"] + (1 + margin) * area["h"]))
+    return x0, y0, x1, y1
+
+
+def _to_image_coordinates(face_obj, x0, y0):
+    area = face_obj["facial_area"]
+    area["x"] += x0
+    area["y"] += y0
+    for eye in ("left_eye", "right_eye"):
+        if area.get(eye) is not None:
+            area[eye] = (area[eye][0] + x0, area[eye][1] + y0)
+    return face_obj
+
+
+def _scaled_area(area, scale):
+    scaled = {k: int(round(area[k] * scale)) for k in ("x", "y", "w", "h")}
+    for eye in ("left_eye", "right_eye"):
+        if area.get(eye) is not None:
+            scaled[eye] = (int(round(area[eye][0] * scale)), int(round(area[eye][1] * scale)))
+    return {**area, **scaled}
+
+
+def detect_face(img, search_area=None):
+    """
+    Detect and align the face in a decoded BGR image; raises FaceRejected if there is none.
+
+    With `search_area` (the facial_area found in a previous frame of a stream) only a
+    window around it is searched, falling back to the whole image when the face has
+    moved out of it. The returned facial_area is always in full-image coordinates.
+    """
+    with stage("detection"):
+        face_obj = None
+        if search_area is not None:
+            x0, y0, x1, y1 = _search_window(img, search_area, TRACK_MARGIN)
+            face_obj = extract_first_face(img[y0:y1, x0:x1])
+            if face_obj is not None:
+                face_obj = _to_image_coordinates(face_obj, x0, y0)
+        if face_obj is None:
+            face_obj = extract_first_face(img)
+    if face_obj is None:
+        raise FaceRejected(NO_FACE_DETAIL)
+    return face_obj
+
+
+def screen_face(img, face_obj, purpose="verification", anti_spoofing=True):
+    """Completeness and anti-spoofing checks on a detected face; raises FaceRejected."""
+    with stage("completeness"):
+        is_complete, error_message = check_face_completeness(face_obj, img)
+    if not is_complete:
+        raise FaceRejected(
+            f"Incomplete face detected: {error_message}. Please ensure your entire face is visible and centered in the frame."
+        )
+    logger.info("Face completeness check passed")
+
+    if anti_spoofing:
+        with stage("anti_spoofing"):
+            is_real = _anti_spoof(img, face_obj)
+        if not is_real:
+            raise FaceRejected(f"Potential spoofing detected. Please use a real face for {purpose}.")
+
+
+def check_quality(img, scale=1.0):
+    """Pre-model quality gate (resolution, exposure, blur); raises FaceRejected."""
+    with stage("quality"):
+        is_usable, error_message = check_image_quality(img, scale)
+    if not is_usable:
+        raise FaceRejected(f"{error_message}. Please retake the photo in even lighting and hold the camera steady.")
+
+
+def check_face(img, purpose="verification", anti_spoofing=True, scale=1.0):
+    """
+    Run the quality gate on a decoded BGR image, detect the face and run the
+    completeness and anti-spoofing checks on it. `scale` is original pixels per pixel
+    of `img`. Returns the DeepFace face object; raises FaceRejected.
+    """
+    check_quality(img, scale)
+    face_obj = detect_face(img)
+    screen_face(img, face_obj, purpose, anti_spoofing)
+    return face_obj
+
+
+def analyze_face(img, purpose="verification", anti_spoofing=True):
+    """
+    Single-pass face analysis on a decoded BGR image.
+
+    The face is detected and aligned once with yunet; the same facial area feeds the
+    completeness check and the anti-spoofing model, and the same aligned crop is
+    embedded with VGG-Face. Each step is recorded as its own metrics stage.
+
+    Returns:
+        dict with the DeepFace face object under "face" and the embedding under "embedding".
+
+    Raises:
+        FaceRejected: no face, incomplete face or spoof detected.
+    """
+    face_obj = check_face(img, purpose, anti_spoofing)
+    with stage("embedding"):
+        embedding = embed_face(face_obj["face"])
+    return {"face": face_obj, "embedding": embedding}
+
+
+def crop_for_embedding(data, img, face_obj, scale):
+    """
+    The aligned face crop to embed for a face found in the working image `img`,
+    which was decoded from `data` at 1/`scale` of its size.
+
+    The working image's own crop is used unless the face is narrower than
+    FACE_CROP_MIN_PX there and the upload has more pixels: then the upload is decoded
+    again at the coarsest scale that gives the face enough of them, and the face is
+    re-aligned from a window around it.
+    """
+    width = face_obj["facial_area"]["w"]
+    if scale <= 1 or width >= FACE_CROP_MIN_PX:
+        return face_obj["face"]
+    with stage("crop"):
+        finer = decode_image(data, coarsest_reduction(width * scale, FACE_CROP_MIN_PX))
+        if finer is None:
+            return face_obj["face"]
+        ratio = max(finer.shape[:2]) / max(img.shape[:2])
+        x0, y0, x1, y1 = _search_window(finer, _scaled_area(face_obj["facial_area"], ratio), TRACK_MARGIN)
+        refined = extract_first_face(finer[y0:y1, x0:x1])
+    return face_obj["face"] if refined is None else refined["face"]
+
+
+def _analyze_working_image(data, purpose, anti_spoofing):
+    """Decode at the working resolution and check the face; returns (face_obj, embedding crop)."""
+    with stage("decode"):
+        img, scale = decode_working_image(data)
+    if img is None:
+        raise FaceRejected(UNREADABLE_IMAGE_DETAIL)
+    face_obj = check_face(img, purpose, anti_spoofing, scale)
+    face_obj["face"] = crop_for_embedding(data, img, face_obj, scale)
+    # Reported in the upload's own pixel coordinates
+    face_obj["facial_area"] = _scaled_area(face_obj["facial_area"], scale)
+    return face_obj
+
+
+def analyze_upload(data, purpose="verification", anti_spoofing=True):
+    """
+    analyze_face on uploaded image bytes, through the content-addressed analysis cache.
+
+    Detection and the face checks run on a copy decoded at no more than
+    MAX_WORKING_RESOLUTION; only the face is taken at higher resolution, when needed.
+
+    A retried or duplicate upload (same bytes, purpose and anti-spoofing setting)
+    gets the cached outcome — the embedding, or the same FaceRejected — without
+    decoding or running any model. Cached results hold the facial area and scores
+    but not the aligned face crop.
+    """
+    key = content_key(data, purpose, anti_spoofing)
+    cached = analysis_cache.get(key)
+    if cached is not None:
+        if "rejected" in cached:
+            raise FaceRejected(cached["rejected"])
+        return cached
+
+    try:
+        face_obj = _analyze_working_image(data, purpose, anti_spoofing)
+    except FaceRejected as rejected:
+        analysis_cache.put(key, {"rejected": rejected.detail})
+        raise
+    with stage("embedding"):
+        embedding = np.asarray(embed_face(face_obj["face"]), dtype=np.float64)
+
+    embedding.setflags(write=False)  # shared by every later hit
+    face = {k: v for k, v in face_obj.items() if k != "face"}
+    analysis_cache.put(key, {"face": face, "embedding": embedding})
+    return {"face": face_obj, "embedding": embedding}
+
+
+def analyze_frames(uploads, purpose="registration", anti_spoofing=True):
+    """
+    Check every uploaded frame like analyze_upload, then embed all accepted faces in one batch.
+
+    Returns:
+        (embeddings, accepted, rejected): an (n, dim) array for the accepted frames,
+        their frame indices, and a list of {"frame", "detail"} for the rejected ones.
+    """
+    faces, accepted, rejected = [], [], []
+    for i, data in enumerate(uploads):
+        try:
+            faces.append(_analyze_working_image(data, purpose, anti_spoofing)["face"])
+            accepted.append(i)
+        except FaceRejected as e:
+            rejected.append({"frame": i, "detail": e.detail})
+    if not faces:
+        return np.empty((0, 0)), accepted, rejected
+    with stage("embedding"):
+        embeddings = embed_faces(faces)
+    return embeddings, accepted, rejected
+
+
+def build_template(embeddings, method="mean", outlier_threshold=ENROLL_OUTLIER_THRESHOLD):
+    """
+    One enrollment template from several L2-normalized embeddings of the same person.
+
+    The medoid is the frame with the highest total cosine similarity to the others.
+    Frames below `outlier_threshold` similarity to it (blur, another person) are
+    dropped; "mean" then averages the rest and re-normalizes, "medoid" returns it.
+
+    Returns:
+        (template, kept): the unit-norm template and the row indices it was built from.
+    """
+    if method not in TEMPLATE_METHODS:
+        raise ValueError(f"Unknown template method '{method}'. Choose one of: {', '.join(TEMPLATE_METHODS)}")
+    sims = embeddings @ embeddings.T
+    medoid = int(np.argmax(sims.sum(axis=1)))
+    if method == "medoid":
+        return embeddings[medoid], [medoid]
+    kept = np.flatnonzero(sims[medoid] >= outlier_threshold)
+    template = embeddings[kept].mean(axis=0)
+    return template / np.linalg.norm(template), kept.tolist()
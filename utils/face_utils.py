@@ -1,9 +1,92 @@
 import logging
+import os
 from typing import Tuple, Optional
 import cv2
+from dotenv import load_dotenv
+from prometheus_client import Counter
+
+load_dotenv()
+# Pre-model quality gate thresholds: shortest side of the upload (px), mean brightness
+# (0-255), brightness standard deviation, share of pixels clipped to black or white,
+# and variance of the Laplacian at about QUALITY_ANALYSIS_SIZE (lower is blurrier)
+QUALITY_MIN_SIDE = int(os.getenv("QUALITY_MIN_SIDE", "240"))
+QUALITY_MIN_BRIGHTNESS = float(os.getenv("QUALITY_MIN_BRIGHTNESS", "40"))
+QUALITY_MAX_BRIGHTNESS = float(os.getenv("QUALITY_MAX_BRIGHTNESS", "220"))
+QUALITY_MIN_CONTRAST = float(os.getenv("QUALITY_MIN_CONTRAST", "12"))
+QUALITY_MAX_CLIPPED = float(os.getenv("QUALITY_MAX_CLIPPED", "0.5"))
+QUALITY_MIN_SHARPNESS = float(os.getenv("QUALITY_MIN_SHARPNESS", "10"))
+# Longest side the blur and exposure metrics are computed at (down to half of it), so the
+# sharpness threshold means roughly the same for every upload size
+QUALITY_ANALYSIS_SIZE = 640
+
+QUALITY_REJECTIONS = Counter("fhe_quality_rejections", "Images rejected by the pre-model quality gate", ["reason"])
+QUALITY_REASONS = ("too_small", "too_dark", "too_bright", "low_contrast", "overexposed", "blurry")
 
 logger = logging.getLogger(__name__)
 
+
+def image_quality(img, scale=1.0) -> dict:
+    """
+    Blur, exposure and resolution metrics of a BGR image, computed on a grayscale copy
+    no larger than QUALITY_ANALYSIS_SIZE. `scale` is original pixels per pixel of
+    `img`, for images decoded at reduced resolution.
+    """
+    height, width = img.shape[:2]
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # Integer factors take OpenCV's fast area-averaging path (~0.1 ms instead of ~4 ms)
+    factor = -(-max(height, width) // QUALITY_ANALYSIS_SIZE)
+    if factor > 1:
+        gray = cv2.resize(gray, None, fx=1 / factor, fy=1 / factor, interpolation=cv2.INTER_AREA)
+    mean, std = cv2.meanStdDev(gray)
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    _, sharpness = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_32F))
+    return {
+        "min_side": int(round(min(height, width) * scale)),
+        "brightness": float(mean[0, 0]),
+        "contrast": float(std[0, 0]),
+        "clipped": float((hist[:6].sum() + hist[250:].sum()) / gray.size),
+        "sharpness": float(sharpness[0, 0] ** 2),
+    }
+
+
+def check_image_quality(img, scale=1.0) -> Tuple[bool, Optional[str]]:
+    """
+    Cheap quality gate run before any model: rejects images that are too small, too
+    dark or bright, flat, mostly clipped or blurry. Rejections are counted per reason
+    in fhe_quality_rejections.
+
+    Returns:
+        Tuple containing:
+        - Boolean indicating if the image is usable
+        - Error message if it is not, None otherwise
+    """
+    metrics = image_quality(img, scale)
+    checks = [
+        ("too_small", metrics["min_side"] < QUALITY_MIN_SIDE, "Image resolution too low"),
+        ("too_dark", metrics["brightness"] < QUALITY_MIN_BRIGHTNESS, "Image too dark"),
+        ("too_bright", metrics["brightness"] > QUALITY_MAX_BRIGHTNESS, "Image too bright"),
+        ("low_contrast", metrics["contrast"] < QUALITY_MIN_CONTRAST, "Image has too little contrast"),
+        ("overexposed", metrics["clipped"] > QUALITY_MAX_CLIPPED, "Image is over- or underexposed"),
+        ("blurry", metrics["sharpness"] < QUALITY_MIN_SHARPNESS, "Image too blurry"),
+    ]
+    for reason, failed, message in checks:
+        if failed:
+            QUALITY_REJECTIONS.labels(reason=reason).inc()
+            logger.info(f"Quality gate rejected image ({reason}): {metrics}")
+            return False, message
+    return True, None
+
+
+def quality_rejection_counts() -> dict:
+    """Images rejected by the quality gate since startup, per reason."""
+    counts = dict.fromkeys(QUALITY_REASONS, 0)
+    for metric in QUALITY_REJECTIONS.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_total"):
+                counts[sample.labels["reason"]] = int(sample.value)
+    return counts
+
+
 def check_face_completeness(face_obj, img=None) -> Tuple[bool, Optional[str]]:
     """
     Check if the face is complete (entire face is visible in the frame).
@@ -0,0 +1,261 @@
+"""
+Lean public contexts: Galois keys for exactly the rotations this service performs.
+
+`context.generate_galois_keys()` creates a key for every power-of-two rotation in
+both directions and TenSEAL stores them unseeded, which is most of public.txt.
+The encrypted kernels here only need:
+
+  dot     sum_vector after the slot-wise product: rotations by 2^k < next_pow2(dim)
+  matmul  diagonal vector-matrix product: rotations by 1 .. dim-1, which SEAL
+          decomposes into the non-adjacent form (NAF) terms +-2^k it has keys for
+
+so this module generates keys for the union of those steps with SEAL's
+KeyGenerator and writes them (seeded, roughly half the size) into the public
+context in place of the full set.
+
+    python -m utils.galois compare [--profile default] [--dim 4096] [--ops dot matmul] [--gallery 64]
+    python -m utils.galois write [--dim 4096] [--ops dot matmul]   # rewrite context/public.txt (default ops: GALOIS_KEY_OPS)
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import numpy as np
+import tenseal as ts
+import tenseal.sealapi as sealapi
+
+KERNELS = ("dot", "matmul")
+
+# Field numbers of TenSEAL's serialized context protobuf (TenSEALContextProto):
+# the public part is field 2 at the top level, its Galois keys field 5 inside it.
+_PUBLIC_CONTEXT_FIELD = 2
+_GALOIS_KEYS_FIELD = 5
+
+
+def naf(value):
+    """Non-adjacent form of `value` as signed powers of two, as SEAL decomposes rotation steps."""
+    terms, sign, bit = [], -1 if value < 0 else 1, 0
+    value = abs(value)
+    while value:
+        digit = 2 - (value & 3) if value & 1 else 0
+        value = (value - digit) >> 1
+        if digit:
+            terms.append(sign * digit * (1 << bit))
+        bit += 1
+    return terms
+
+
+def _normalize_step(step, slots):
+    # Rotations are cyclic over the slots; keep steps in (-slots/2, slots/2]
+    step %= slots
+    return step - slots if step > slots // 2 else step
+
+
+def rotation_steps(dim, slots, kernels=KERNELS):
+    """Sorted rotation steps the given encrypted kernels need for `dim`-long vectors."""
+    if dim > slots:
+        raise ValueError(f"{dim}-dim vectors do not fit in {slots} slots")
+    steps = set()
+    if "dot" in kernels:
+        step = 1
+        while step < dim:
+            steps.add(step)
+            step *= 2
+    if "matmul" in kernels:
+        for i in range(1, dim):
+            steps.update(naf(i))
+    steps = {_normalize_step(step, slots) for step in steps}
+    steps.discard(0)
+    return sorted(steps)
+
+
+def galois_element(step, poly_modulus_degree):
+    """SEAL's GaloisTool::get_elt_from_step for CKKS row rotations."""
+    m = 2 * poly_modulus_degree
+    if step < 0:
+        step += poly_modulus_degree // 2
+    return pow(3, step, m)
+
+
+def _read_varint(data, i):
+    result = shift = 0
+    while True:
+        byte = data[i]
+        i += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return result, i
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte, value = value & 0x7F, value >> 7
+        out.append(byte | 0x80 if value else byte)
+        if not value:
+            return bytes(out)
+
+
+def _proto_fields(data):
+    """Top-level (field, wire_type, raw_value) triples of a protobuf message."""
+    fields, i = [], 0
+    while i < len(data):
+        key, i = _read_varint(data, i)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, i = _read_varint(data, i)
+        elif wire_type == 1:
+            value, i = data[i:i + 8], i + 8
+        elif wire_type == 2:
+            length, i = _read_varint(data, i)
+            value, i = data[i:i + length], i + length
+        elif wire_type == 5:
+            value, i = data[i:i + 4], i + 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        fields.append((field, wire_type, value))
+    return fields
+
+
+def _proto_encode(fields):
+    parts = []
+    for field, wire_type, value in fields:
+        parts.append(_varint((field << 3) | wire_type))
+        if wire_type == 0:
+            parts.append(_varint(value))
+        elif wire_type == 2:
+            parts.append(_varint(len(value)) + value)
+        else:
+            parts.append(value)
+    return b"".join(parts)
+
+
+def galois_keys_bytes(context, steps):
+    """Seeded, serialized SEAL GaloisKeys for `steps`, made with the context's secret key."""
+    degree = context.seal_context().data.key_context_data().parms().poly_modulus_degree()
+    keygen = sealapi.KeyGenerator(context.seal_context().data, context.secret_key().data)
+    # The pybind overload taking a list resolves to Galois elements, not steps
+    serializable = keygen.create_galois_keys([galois_element(step, degree) for step in steps])
+    fd, path = tempfile.mkstemp(suffix=".galois")
+    os.close(fd)
+    try:
+        serializable.save(path)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+def lean_public_context(context, steps):
+    """
+    Serialized public TenSEAL context holding Galois keys for `steps` only.
+    `context` must hold the secret key; it is not modified.
+    """
+    public = context.copy()
+    public.make_context_public()
+    top = _proto_fields(public.serialize())
+    fields = [f for f in top if f[0] == _PUBLIC_CONTEXT_FIELD and f[1] == 2]
+    if len(fields) != 1:
+        raise ValueError("Unexpected TenSEAL context layout; cannot embed lean Galois keys")
+    inner = [f for f in _proto_fields(fields[0][2]) if f[0] != _GALOIS_KEYS_FIELD]
+    if steps:
+        inner.append((_GALOIS_KEYS_FIELD, 2, galois_keys_bytes(context, steps)))
+    patched = [(f, t, _proto_encode(inner)) if f == _PUBLIC_CONTEXT_FIELD else (f, t, v) for f, t, v in top]
+    data = _proto_encode(patched)
+
+    if steps and not ts.context_from(data).has_galois_keys():
+        raise ValueError("Lean public context did not load with its Galois keys")
+    return data
+
+
+def _median_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return round(statistics.median(samples) * 1000, 3)
+
+
+def compare(profile, dim, kernels, gallery, repeat, seed=0):
+    """Size, load time and kernel latency of the full-key vs. the lean public context."""
+    from utils.tenseal_context import create_context
+    from utils.packing import slot_count
+
+    context = create_context(profile, galois_keys=False)
+    slots = slot_count(context)
+    steps = rotation_steps(dim, slots, kernels)
+
+    full = context.copy()
+    full.generate_galois_keys()
+    full.make_context_public()
+    variants = {"full": full.serialize(), "lean": lean_public_context(context, steps)}
+
+    rng = np.random.default_rng(seed)
+    probe, template = rng.standard_normal((2, dim))
+    matrix = rng.standard_normal((dim, gallery)) if gallery else None
+    enc_probe = ts.ckks_vector(context, probe).serialize()
+
+    reports = []
+    for name, data in variants.items():
+        public = ts.context_from(data)
+        report = {
+            "variant": name,
+            "profile": profile,
+            "dim": dim,
+            "galois_keys": len(steps) if name == "lean" else "all",
+            "public_context_bytes": len(data),
+            "load_ms": _median_ms(lambda: ts.context_from(data), repeat),
+        }
+        vector = ts.ckks_vector_from(public, enc_probe)
+        enc_template = ts.ckks_vector(public, template)
+        report["dot_ms"] = _median_ms(lambda: vector.dot(enc_template), repeat)
+        score = ts.ckks_vector_from(context, vector.dot(enc_template).serialize()).decrypt()[0]
+        report["dot_abs_error"] = abs(score - float(probe @ template))
+        if matrix is not None:
+            start = time.perf_counter()
+            result = vector.matmul(matrix.tolist())
+            report["matmul_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            scores = np.array(ts.ckks_vector_from(context, result.serialize()).decrypt())
+            report["matmul_max_abs_error"] = float(np.abs(scores - probe @ matrix).max())
+        reports.append(report)
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    cmp = sub.add_parser("compare", help="measure the full-key vs. the lean public context")
+    cmp.add_argument("--profile", default="default")
+    cmp.add_argument("--dim", type=int, default=4096)
+    cmp.add_argument("--ops", nargs="+", choices=KERNELS, default=list(KERNELS))
+    cmp.add_argument("--gallery", type=int, default=0, help="also time a matmul against this many templates")
+    cmp.add_argument("--repeat", type=int, default=5)
+
+    write = sub.add_parser("write", help="rewrite the public context file with lean Galois keys")
+    write.add_argument("--dim", type=int, default=4096)
+    write.add_argument("--ops", nargs="+", choices=KERNELS, help="default: GALOIS_KEY_OPS")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        for report in compare(args.profile, args.dim, args.ops, args.gallery, args.repeat):
+            line = (
+                f"{report['variant']:>5}: keys={report['galois_keys']} "
+                f"public={report['public_context_bytes'] / 2**20:.1f}MiB load={report['load_ms']}ms "
+                f"dot={report['dot_ms']}ms (err {report['dot_abs_error']:.1e})"
+            )
+            if "matmul_ms" in report:
+                line += f" matmul={report['matmul_ms']}ms (err {report['matmul_max_abs_error']:.1e})"
+            print(line)
+        return
+
+    from utils.tenseal_context import GALOIS_KEY_OPS, PUBLIC_PATH, write_public_context, load_secret_context
+    steps = write_public_context(load_secret_context(), args.dim, args.ops or GALOIS_KEY_OPS)
+    print(f"Wrote {PUBLIC_PATH} with Galois keys for {len(steps)} rotation steps: {steps}")
+
+
+if __name__ == "__main__":
+    main()
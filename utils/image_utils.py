@@ -0,0 +1,94 @@
+import os
+import struct
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+# Longest side (px) uploads are decoded to for detection and the face checks; 0 decodes at full size
+MAX_WORKING_RESOLUTION = int(os.getenv("MAX_WORKING_RESOLUTION", "1280"))
+
+# Scale factors libjpeg can decode at directly (other formats are decoded, then resized)
+REDUCED_MODES = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Start-of-frame markers (SOF0-SOF15 without DHT, JPG and DAC) carry the image size
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def decode_image(data: bytes, reduction=1):
+    """
+    Decode uploaded image bytes straight into a BGR array, without touching disk,
+    optionally at 1/2, 1/4 or 1/8 of the full size.
+
+    Returns None if the bytes are empty or not a decodable image, like cv2.imread.
+    """
+    if not data:
+        return None
+    buf = np.frombuffer(data, dtype=np.uint8)
+    return cv2.imdecode(buf, REDUCED_MODES[reduction])
+
+
+def image_size(data: bytes):
+    """(width, height) from a JPEG or PNG header, without decoding; None for anything else."""
+    if data[:8] == _PNG_SIGNATURE and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # markers without a length
+            i += 2
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+
+def coarsest_reduction(size, min_size):
+    """Largest libjpeg scale factor that keeps `size` pixels at or above `min_size`."""
+    return max((f for f in REDUCED_MODES if size / f >= min_size), default=1)
+
+
+def decode_working_image(data: bytes, max_side=MAX_WORKING_RESOLUTION):
+    """
+    Decode an upload no larger than `max_side` pixels on its longest side.
+
+    A large JPEG is decoded by libjpeg directly at the finest 1/2, 1/4 or 1/8 scale
+    that fits, so the full-resolution image is never held in memory; the working
+    image is then between half and all of `max_side`. Only images that are still too
+    large at 1/8 (or aren't JPEG) are resized, since a resize costs about as much as
+    the scaled decode saves.
+
+    Returns:
+        (img, scale): the working image and the original pixels per working-image
+        pixel, or (None, 1.0) if the bytes can't be decoded.
+    """
+    if not data:
+        return None, 1.0
+    size = image_size(data) if max_side > 0 else None
+    reduction = 1
+    if size:
+        reduction = min((f for f in REDUCED_MODES if max(size) / f <= max_side), default=max(REDUCED_MODES))
+    img = decode_image(data, reduction)
+    if img is None:
+        return None, 1.0
+    original_longest = max(size) if size else max(img.shape[:2])
+    height, width = img.shape[:2]
+    if max_side > 0 and max(height, width) > max_side:
+        factor = max_side / max(height, width)
+        img = cv2.resize(img, (round(width * factor), round(height * factor)), interpolation=cv2.INTER_AREA)
+    return img, original_longest / max(img.shape[:2])
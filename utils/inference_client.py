@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from prometheus_client import Histogram
+
+load_dotenv()
+# Unix socket of the shared inference server (python -m utils.inference_server); empty runs the models in-process
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "")
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "30"))
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = Histogram(
+    "fhe_inference_batch_size", "Faces in the inference server batch that embedded a request's face",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+
+# Messages between the API workers and the inference server:
+#
+#   header_len u32 | header (UTF-8 JSON) | raw array buffers
+#
+# header["arrays"] lists the dtype and shape of each buffer that follows, in order.
+# Only plain numeric arrays cross the socket, nothing is pickled.
+
+_LENGTH = struct.Struct(">I")
+MAX_HEADER_BYTES = 1 << 20
+ARRAY_DTYPES = {"uint8", "float32", "float64"}
+
+
+class InferenceUnavailable(ConnectionError):
+    pass
+
+
+def _recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    while view:
+        got = sock.recv_into(view)
+        if not got:
+            raise ConnectionError("Inference socket closed mid-message")
+        view = view[got:]
+    return buf
+
+
+def send_message(sock, header, arrays=()):
+    arrays = [np.ascontiguousarray(a) for a in arrays]
+    header = dict(header, arrays=[{"dtype": a.dtype.name, "shape": list(a.shape)} for a in arrays])
+    data = json.dumps(header).encode("utf-8")
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+    for a in arrays:
+        sock.sendall(memoryview(a).cast("B"))
+
+
+def recv_message(sock):
+    """(header, arrays) of the next message, or (None, []) if the peer closed the connection cleanly."""
+    first = sock.recv(_LENGTH.size)
+    if not first:
+        return None, []
+    if len(first) < _LENGTH.size:
+        first += _recv_exact(sock, _LENGTH.size - len(first))
+    (length,) = _LENGTH.unpack(first)
+    if length > MAX_HEADER_BYTES:
+        raise ValueError(f"Inference message header of {length} bytes is too large")
+    header = json.loads(_recv_exact(sock, length))
+    arrays = []
+    for spec in header.pop("arrays", []):
+        if spec["dtype"] not in ARRAY_DTYPES:
+            raise ValueError(f"Unsupported array dtype {spec['dtype']}")
+        dtype, shape = np.dtype(spec["dtype"]), tuple(spec["shape"])
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        arrays.append(np.frombuffer(_recv_exact(sock, nbytes), dtype=dtype).reshape(shape))
+    return header, arrays
+
+
+def _face_from_wire(face, crop):
+    area = face["facial_area"]
+    for eye in ("left_eye", "right_eye"):
+        if area.get(eye) is not None:
+            area[eye] = tuple(area[eye])
+    face["face"] = crop
+    return face
+
+
+class InferenceClient:
+    """
+    Client for the shared inference server, with the same calls as utils.deepface_utils.
+
+    Every thread keeps its own connection to the socket, so the worker pool's threads
+    send requests in parallel and the server can batch them. The calls are read-only,
+    so a request that fails on a dropped connection (e.g. a server restart) is sent
+    once more on a new one.
+    """
+
+    def __init__(self, path=INFERENCE_SOCKET, timeout=INFERENCE_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            raise InferenceUnavailable(f"Inference server at {self.path} is unavailable: {e}")
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def call(self, op, arrays=(), **fields):
+        for attempt in range(2):
+            if getattr(self._local, "sock", None) is None:
+                self._local.sock = self._connect()
+            try:
+                send_message(self._local.sock, {"op": op, **fields}, arrays)
+                header, result = recv_message(self._local.sock)
+                if header is None:
+                    raise ConnectionError("Inference server closed the connection")
+                break
+            except socket.timeout:
+                self._close()
+                raise
+            except (ConnectionError, OSError) as e:
+                self._close()
+                if attempt:
+                    raise InferenceUnavailable(f"Inference server at {self.path} is unavailable: {e}")
+                logger.warning(f"Inference connection lost ({e}); reconnecting")
+        if "error" in header:
+            raise RuntimeError(f"Inference server: {header['error']}")
+        return header, result
+
+    def extract_first_face(self, img):
+        header, arrays = self.call("detect", [img])
+        if header["face"] is None:
+            return None
+        return _face_from_wire(header["face"], arrays[0])
+
+    def anti_spoof(self, img, facial_area):
+        area = {k: facial_area[k] for k in ("x", "y", "w", "h")}
+        header, _ = self.call("anti_spoof", [img], facial_area=area)
+        return header["is_real"], header["score"]
+
+    def embed_faces(self, faces):
+        header, arrays = self.call("embed", list(faces))
+        for size in header["batch_sizes"]:
+            BATCH_SIZE.observe(size)
+        return arrays[0]
+
+    def embed_face(self, face) -> list:
+        return self.embed_faces([face])[0].tolist()
+
+    def extract_embedding(self, img) -> list:
+        face = self.extract_first_face(img)
+        if face is None:
+            raise ValueError("No face detected in the image.")
+        return self.embed_face(face["face"])
+
+    def ping(self):
+        return self.call("ping")[0]
+
+
+inference_client = InferenceClient() if INFERENCE_SOCKET else None
@@ -0,0 +1,173 @@
+"""
+Shared inference server: one process holds the face detector, the anti-spoofing model
+and VGG-Face, and serves every API worker over a Unix socket. Without it each
+gunicorn/uvicorn worker imports TensorFlow and loads its own copy of the weights.
+
+    INFERENCE_SOCKET=/tmp/fhe-inference.sock python -m utils.inference_server
+    INFERENCE_SOCKET=/tmp/fhe-inference.sock gunicorn main:app -k uvicorn.workers.UvicornWorker -w 4 -b 0.0.0.0:8002
+
+Embedding requests from all connections go through one queue and are run as a single
+batched forward pass. A batch takes everything that queued up while the previous
+batch was running, plus whatever arrives within INFERENCE_BATCH_WAIT seconds, up to
+INFERENCE_MAX_BATCH faces. Detection runs one image at a time, since the yunet
+detector object is not safe to share between threads.
+"""
+import argparse
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from dotenv import load_dotenv
+from utils import deepface_utils
+from utils.inference_client import INFERENCE_SOCKET, recv_message, send_message
+
+load_dotenv()
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "32"))
+INFERENCE_BATCH_WAIT = float(os.getenv("INFERENCE_BATCH_WAIT", "0.002"))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """Queue of faces from every connection, embedded by one thread in batches."""
+
+    def __init__(self, max_batch=INFERENCE_MAX_BATCH, wait=INFERENCE_BATCH_WAIT):
+        self.max_batch = max_batch
+        self.wait = wait
+        self._queue = queue.Queue()
+        self.batches = 0
+        self.faces = 0
+        threading.Thread(target=self._run, name="embedding-batcher", daemon=True).start()
+
+    def embed(self, faces):
+        """(embeddings, batch sizes) for `faces`, once the batches holding them have run."""
+        futures = []
+        for face in faces:
+            future = Future()
+            self._queue.put((face, future))
+            futures.append(future)
+        results = [future.result() for future in futures]
+        return np.stack([embedding for embedding, _ in results]), sorted({size for _, size in results})
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.wait
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                embeddings = deepface_utils.embed_faces([face for face, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.faces += len(batch)
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result((embedding, len(batch)))
+
+
+def _jsonable(value):
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class InferenceHandler(socketserver.BaseRequestHandler):
+    """One API worker thread's connection: requests are answered in order."""
+
+    def handle(self):
+        while True:
+            try:
+                header, arrays = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            if header is None:
+                return
+            try:
+                response, out = self.server.dispatch(header, arrays)
+            except Exception as e:
+                logger.error(f"Inference request '{header.get('op')}' failed: {e}")
+                response, out = {"error": str(e)}, []
+            try:
+                send_message(self.request, response, out)
+            except OSError:
+                return
+
+
+class InferenceServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, batcher):
+        if os.path.exists(path):
+            os.remove(path)  # left behind by a previous run
+        super().__init__(path, InferenceHandler)
+        os.chmod(path, 0o600)  # only processes of the same user may use the models
+        self.batcher = batcher
+        self._detector_lock = threading.Lock()
+
+    def dispatch(self, header, arrays):
+        op = header.get("op")
+        if op == "detect":
+            with self._detector_lock:
+                face = deepface_utils.extract_first_face(arrays[0])
+            if face is None:
+                return {"face": None}, []
+            crop = face.pop("face")
+            return {"face": _jsonable(face)}, [crop]
+        if op == "anti_spoof":
+            is_real, score = deepface_utils.anti_spoof(arrays[0], header["facial_area"])
+            return {"is_real": bool(is_real), "score": float(score)}, []
+        if op == "embed":
+            embeddings, sizes = self.batcher.embed(arrays)
+            return {"batch_sizes": sizes}, [embeddings]
+        if op == "ping":
+            return {"batches": self.batcher.batches, "faces": self.batcher.faces}, []
+        raise ValueError(f"Unknown inference op '{op}'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=INFERENCE_SOCKET or "/tmp/fhe-inference.sock")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    deepface_utils.warm_up()
+    logger.info(f"Face models loaded in {time.perf_counter() - start:.1f}s")
+
+    with InferenceServer(args.socket, EmbeddingBatcher()) as server:
+        logger.info(f"Inference server listening on {args.socket}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import asyncio
+import io
+import logging
+import os
+import httpx
+from dotenv import load_dotenv
+from utils.metrics import CIPHERTEXT_BYTES
+
+load_dotenv()
+SERVER_URL = os.getenv("SERVER_URL", "http://localhost:8000")
+SERVER_CONNECT_TIMEOUT = float(os.getenv("SERVER_CONNECT_TIMEOUT", "5"))
+SERVER_TIMEOUT = float(os.getenv("SERVER_TIMEOUT", "60"))
+SERVER_MAX_CONNECTIONS = int(os.getenv("SERVER_MAX_CONNECTIONS", "32"))
+SERVER_RETRIES = int(os.getenv("SERVER_RETRIES", "2"))
+SERVER_RETRY_BACKOFF = float(os.getenv("SERVER_RETRY_BACKOFF", "0.2"))
+
+# Gateway-style failures that are safe to retry when the call itself is idempotent
+RETRY_STATUS_CODES = {502, 503, 504}
+
+logger = logging.getLogger(__name__)
+
+
+class MainServerClient:
+    """
+    Shared async HTTP client for calls to the main server.
+
+    One connection pool with keep-alive is built at startup and reused by every
+    request. Connection errors and connect timeouts are retried by the transport for
+    all calls, since nothing was sent; 502/503/504 responses are retried here, only
+    for calls marked idempotent. Read and write timeouts are not retried: the main server
+    was already busy with the request for SERVER_TIMEOUT, and a retry would wait as long again.
+    """
+
+    def __init__(self, base_url=SERVER_URL):
+        self.base_url = base_url
+        self._client = None
+
+    def _build_client(self):
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(SERVER_TIMEOUT, connect=SERVER_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=SERVER_MAX_CONNECTIONS,
+                max_keepalive_connections=SERVER_MAX_CONNECTIONS,
+            ),
+            transport=httpx.AsyncHTTPTransport(retries=SERVER_RETRIES),
+        )
+
+    @property
+    def client(self):
+        # Built lazily as well, so scripts and tests that skip the app lifespan still work
+        if self._client is None:
+            self._client = self._build_client()
+        return self._client
+
+    async def start(self):
+        self.client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def post_ciphertext(self, path, enc_bytes, data=None, headers=None, idempotent=False):
+        """
+        POST a serialized ciphertext as the multipart `file` field.
+
+        The body is streamed from a file object instead of being copied into one
+        multipart buffer first.
+        """
+        CIPHERTEXT_BYTES.labels(direction="sent").observe(len(enc_bytes))
+        attempts = 1 + (SERVER_RETRIES if idempotent else 0)
+        for attempt in range(attempts):
+            files = {"file": ("embedding.bin", io.BytesIO(enc_bytes), "application/octet-stream")}
+            resp = await self.client.post(path, data=data, files=files, headers=headers)
+            if resp.status_code not in RETRY_STATUS_CODES or attempt + 1 >= attempts:
+                CIPHERTEXT_BYTES.labels(direction="received").observe(len(resp.content))
+                return resp
+            logger.warning(f"Main server returned {resp.status_code} on {path}, retrying")
+            await asyncio.sleep(SERVER_RETRY_BACKOFF * (2 ** attempt))
+
+
+main_server = MainServerClient()
@@ -0,0 +1,73 @@
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram
+
+# Prometheus metrics, served by main.py at /metrics.
+#
+# Pipeline stages are timed with `stage(name)` (or `timed(name, fn)` for calls handed
+# to the worker pool). Besides the histogram, each timing is appended to the current
+# request's list, which the HTTP middleware turns into a Server-Timing header.
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = tuple(2**i for i in range(12, 26))  # 4 KiB .. 32 MiB
+COUNT_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+STAGE_SECONDS = Histogram(
+    "fhe_stage_duration_seconds", "Time spent in one pipeline stage", ["stage"], buckets=STAGE_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "fhe_http_request_duration_seconds", "HTTP request latency", ["method", "endpoint", "status"],
+    buckets=STAGE_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge("fhe_http_requests_in_flight", "HTTP requests currently being served")
+CIPHERTEXT_BYTES = Histogram(
+    "fhe_ciphertext_bytes", "Size of serialized ciphertext payloads", ["direction"], buckets=BYTES_BUCKETS
+)
+GALLERY_RESULTS = Histogram(
+    "fhe_gallery_results", "Candidate results returned by the main server per verification",
+    buckets=COUNT_BUCKETS,
+)
+CONTEXT_LOAD_SECONDS = Gauge(
+    "fhe_context_load_seconds", "Duration of the last load of a TenSEAL context", ["context"]
+)
+CONTEXT_LOADS = Counter("fhe_context_loads", "TenSEAL context loads and reloads", ["context"])
+
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def start_request_timings():
+    """Begin collecting stage timings for the current request; returns the (shared) list."""
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+
+def record_stage(name, seconds):
+    STAGE_SECONDS.labels(stage=name).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def timed(name, fn):
+    """Wrap `fn` so each call is recorded as stage `name` (timed where it runs, e.g. on a worker)."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with stage(name):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def server_timing_header(timings):
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings)
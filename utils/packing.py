@@ -0,0 +1,67 @@
+import math
+import numpy as np
+
+
+def slot_count(context):
+    # CKKS packs poly_modulus_degree / 2 complex slots per ciphertext
+    parms = context.seal_context().data.key_context_data().parms()
+    return parms.poly_modulus_degree() // 2
+
+
+def next_power_of_two(n: int) -> int:
+    return 1 << max(0, int(n) - 1).bit_length()
+
+
+def pack_layout(count: int, dim: int, slots: int) -> dict:
+    """
+    Describe how `count` embeddings of length `dim` are laid out across ciphertexts.
+
+    Every embedding occupies a block of `stride` slots, where `stride` is `dim`
+    rounded up to a power of two so blocks line up with rotation steps. Embedding
+    `i` lives in ciphertext `i // per_ciphertext` starting at slot
+    `(i % per_ciphertext) * stride`; the trailing `stride - dim` slots are zero.
+    """
+    if dim <= 0:
+        raise ValueError("Embedding dimension must be positive")
+    stride = next_power_of_two(dim)
+    if stride > slots:
+        raise ValueError(f"Embedding dimension {dim} does not fit in {slots} slots")
+    per_ciphertext = slots // stride
+    return {
+        "count": count,
+        "dim": dim,
+        "stride": stride,
+        "slot_count": slots,
+        "per_ciphertext": per_ciphertext,
+        "ciphertexts": math.ceil(count / per_ciphertext) if count else 0,
+    }
+
+
+def locate(layout: dict, index: int):
+    """Return (ciphertext index, first slot) of embedding `index` in a packed layout."""
+    per_ciphertext = layout["per_ciphertext"]
+    return index // per_ciphertext, (index % per_ciphertext) * layout["stride"]
+
+
+def pack_embeddings(embeddings: np.ndarray, slots: int):
+    """
+    Pack a (count, dim) matrix into as few slot vectors as possible.
+
+    Returns the list of plaintext vectors to encrypt and the layout descriptor.
+    Every vector is `slots` long, zero-padded past the last block, so all batch
+    sizes encrypt vectors of one length (the encryption pool's slot-count pool).
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float64)
+    if embeddings.ndim != 2:
+        raise ValueError("Expected a 2-D array of embeddings")
+    count, dim = embeddings.shape
+    layout = pack_layout(count, dim, slots)
+    stride, per_ciphertext = layout["stride"], layout["per_ciphertext"]
+
+    vectors = []
+    for start in range(0, count, per_ciphertext):
+        chunk = embeddings[start:start + per_ciphertext]
+        block = np.zeros((per_ciphertext, stride), dtype=np.float64)
+        block[:len(chunk), :dim] = chunk
+        vectors.append(block.reshape(-1))
+    return vectors, layout
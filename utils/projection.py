@@ -0,0 +1,215 @@
+"""
+Optional dimensionality reduction of embeddings before encryption.
+
+A projection (PCA fitted on real embeddings, or a seeded random projection) is
+fitted offline and stored next to the TenSEAL context as `projection.npz`. When the
+file exists, embeddings are projected and L2-normalized before `ts.ckks_vector`,
+which shrinks every ciphertext and the rotation count of the encrypted dot product.
+
+    python -m utils.projection fit --kind pca --dim 256 --embeddings emb.npy
+    python -m utils.projection fit --kind random --dim 256 --input-dim 4096 --seed 7
+    python -m utils.projection evaluate --embeddings emb.npy --labels labels.npy
+
+Templates enrolled with one projection only match probes projected with the same
+one, so the version tag is sent along with every encrypted embedding.
+"""
+import argparse
+import hashlib
+import logging
+import os
+import threading
+import numpy as np
+from utils.tenseal_context import CONTEXT_DIR
+
+PROJECTION_PATH = os.path.join(CONTEXT_DIR, "projection.npz")
+
+logger = logging.getLogger(__name__)
+
+
+class Projection:
+    def __init__(self, kind, matrix, mean=None, seed=None):
+        self.kind = kind
+        self.matrix = np.asarray(matrix, dtype=np.float64)  # (out_dim, in_dim)
+        self.mean = np.zeros(self.matrix.shape[1]) if mean is None else np.asarray(mean, dtype=np.float64)
+        self.seed = seed
+        digest = hashlib.sha256(self.matrix.tobytes() + self.mean.tobytes()).hexdigest()[:12]
+        self.version = f"{kind}-{self.out_dim}-{digest}"
+
+    @property
+    def in_dim(self):
+        return self.matrix.shape[1]
+
+    @property
+    def out_dim(self):
+        return self.matrix.shape[0]
+
+    def apply(self, embeddings):
+        """Project one embedding or a (n, in_dim) batch and L2-normalize the result."""
+        embeddings = np.asarray(embeddings, dtype=np.float64)
+        if embeddings.shape[-1] != self.in_dim:
+            raise ValueError(f"Projection expects {self.in_dim}-dim embeddings, got {embeddings.shape[-1]}")
+        projected = (embeddings - self.mean) @ self.matrix.T
+        norms = np.linalg.norm(projected, axis=-1, keepdims=True)
+        return projected / np.where(norms == 0, 1, norms)
+
+    def save(self, path=PROJECTION_PATH):
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            kind=self.kind,
+            matrix=self.matrix,
+            mean=self.mean,
+            seed=-1 if self.seed is None else self.seed,
+            version=self.version,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=PROJECTION_PATH):
+        with np.load(path, allow_pickle=False) as data:
+            seed = int(data["seed"])
+            projection = cls(str(data["kind"]), data["matrix"], data["mean"], None if seed < 0 else seed)
+            if projection.version != str(data["version"]):
+                raise ValueError(f"Projection file {path} is corrupt: version tag does not match its contents")
+        return projection
+
+
+def fit_pca(embeddings, out_dim):
+    embeddings = np.asarray(embeddings, dtype=np.float64)
+    if out_dim > min(embeddings.shape):
+        raise ValueError(f"Need at least {out_dim} embeddings to fit a {out_dim}-dim PCA")
+    mean = embeddings.mean(axis=0)
+    centered = embeddings - mean
+    # Eigen-decomposition of the (in_dim, in_dim) covariance; cheaper than an SVD when n >> in_dim
+    eigvals, eigvecs = np.linalg.eigh(centered.T @ centered)
+    order = np.argsort(eigvals)[::-1][:out_dim]
+    return Projection("pca", eigvecs[:, order].T, mean)
+
+
+def random_projection(in_dim, out_dim, seed):
+    # Orthonormal rows (QR of a Gaussian matrix) preserve inner products best for a given size
+    rng = np.random.default_rng(seed)
+    q, _ = np.linalg.qr(rng.standard_normal((in_dim, out_dim)))
+    return Projection("random", q.T, seed=seed)
+
+
+_lock = threading.Lock()
+_cache = {"signature": None, "projection": None}
+
+
+def get_projection():
+    """The active projection, or None when no projection file is stored next to the context."""
+    try:
+        st = os.stat(PROJECTION_PATH)
+    except FileNotFoundError:
+        return None
+    signature = (st.st_mtime_ns, st.st_size)
+    with _lock:
+        if _cache["signature"] != signature:
+            _cache["projection"] = Projection.load(PROJECTION_PATH)
+            _cache["signature"] = signature
+            logger.info(f"Loaded embedding projection {_cache['projection'].version}")
+        return _cache["projection"]
+
+
+def prepare_embedding(embedding):
+    """
+    Float32 vector to encrypt: the projected, L2-normalized embedding if a projection
+    is active, the embedding unchanged otherwise. Returns (vector, projection version or None).
+    """
+    projection = get_projection()
+    if projection is None:
+        return np.asarray(embedding, dtype=np.float32), None
+    return projection.apply(embedding).astype(np.float32), projection.version
+
+
+def _pair_scores(embeddings, labels):
+    sims = embeddings @ embeddings.T
+    iu = np.triu_indices(len(labels), k=1)
+    same = (labels[:, None] == labels[None, :])[iu]
+    return sims[iu][same], sims[iu][~same]
+
+
+def _rank1(embeddings, labels):
+    # First sample of each identity is the gallery, the rest are probes
+    _, first = np.unique(labels, return_index=True)
+    gallery_mask = np.zeros(len(labels), dtype=bool)
+    gallery_mask[first] = True
+    if gallery_mask.all():
+        return None
+    scores = embeddings[~gallery_mask] @ embeddings[gallery_mask].T
+    predicted = labels[gallery_mask][np.argmax(scores, axis=1)]
+    return float(np.mean(predicted == labels[~gallery_mask]))
+
+
+def evaluate(embeddings, labels, threshold):
+    """Verification and identification quality of a set of L2-normalized embeddings."""
+    genuine, impostor = _pair_scores(embeddings, labels)
+    candidates = np.unique(np.concatenate([genuine, impostor]))
+    # Equal error rate: threshold where false accepts and false rejects cross
+    far = 1 - np.searchsorted(np.sort(impostor), candidates, side="right") / len(impostor)
+    frr = np.searchsorted(np.sort(genuine), candidates, side="right") / len(genuine)
+    eer_index = int(np.argmin(np.abs(far - frr)))
+    accuracy = (np.sum(genuine > threshold) + np.sum(impostor <= threshold)) / (len(genuine) + len(impostor))
+    return {
+        "dim": embeddings.shape[1],
+        "accuracy_at_threshold": float(accuracy),
+        "false_accept_rate": float(np.mean(impostor > threshold)),
+        "false_reject_rate": float(np.mean(genuine <= threshold)),
+        "eer": float((far[eer_index] + frr[eer_index]) / 2),
+        "eer_threshold": float(candidates[eer_index]),
+        "rank1_accuracy": _rank1(embeddings, labels),
+    }
+
+
+def _normalize(embeddings):
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    fit = sub.add_parser("fit", help="fit a projection and store it next to the context")
+    fit.add_argument("--kind", choices=["pca", "random"], default="pca")
+    fit.add_argument("--dim", type=int, required=True, help="output dimension")
+    fit.add_argument("--embeddings", help="(n, in_dim) .npy of training embeddings (pca)")
+    fit.add_argument("--input-dim", type=int, default=4096, help="input dimension (random)")
+    fit.add_argument("--seed", type=int, default=0)
+    fit.add_argument("--output", default=PROJECTION_PATH)
+
+    ev = sub.add_parser("evaluate", help="compare match accuracy before and after projection")
+    ev.add_argument("--embeddings", required=True, help="(n, in_dim) .npy of labelled evaluation embeddings")
+    ev.add_argument("--labels", required=True, help="(n,) .npy of identity labels")
+    ev.add_argument("--projection", default=PROJECTION_PATH)
+    ev.add_argument("--threshold", type=float, default=0.55)
+    ev.add_argument("--projected-threshold", type=float, help="threshold for projected scores (default: same)")
+
+    args = parser.parse_args()
+    if args.command == "fit":
+        if args.kind == "pca":
+            if not args.embeddings:
+                parser.error("--embeddings is required for a PCA projection")
+            projection = fit_pca(np.load(args.embeddings), args.dim)
+        else:
+            projection = random_projection(args.input_dim, args.dim, args.seed)
+        projection.save(args.output)
+        print(f"Saved projection {projection.version} ({projection.in_dim} -> {projection.out_dim}) to {args.output}")
+        return
+
+    embeddings = _normalize(np.load(args.embeddings).astype(np.float64))
+    labels = np.load(args.labels)
+    projection = Projection.load(args.projection)
+    projected_threshold = args.threshold if args.projected_threshold is None else args.projected_threshold
+    before = evaluate(embeddings, labels, args.threshold)
+    after = evaluate(projection.apply(embeddings), labels, projected_threshold)
+
+    print(f"Projection {projection.version}")
+    print(f"{'metric':>22} {'original':>10} {'projected':>10}")
+    for key in before:
+        fmt = lambda v: "n/a" if v is None else (f"{v:.4f}" if isinstance(v, float) else str(v))
+        print(f"{key:>22} {fmt(before[key]):>10} {fmt(after[key]):>10}")
+
+
+if __name__ == "__main__":
+    main()
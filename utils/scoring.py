@@ -0,0 +1,122 @@
+import base64
+import logging
+import numpy as np
+import tenseal as ts
+
+logger = logging.getLogger(__name__)
+
+def _decrypt(enc, context):
+    # Ciphertexts arrive base64-encoded over JSON or as raw bytes over the binary transport
+    if isinstance(enc, str):
+        enc = base64.b64decode(enc)
+    enc = ts.lazy_ckks_vector_from(enc)
+    enc.link_context(context)
+    return enc.decrypt()
+
+
+def _try_decrypt(enc_b64, context):
+    try:
+        return _decrypt(enc_b64, context), None
+    except Exception as e:
+        return None, e
+
+
+def decrypt_results(results, context):
+    """
+    Decrypt every result's `encrypted_similarity`.
+
+    Runs serially inside the caller's worker-pool job: TenSEAL keeps the GIL for most
+    of a decryption, so extra threads only add contention.
+
+    Fills `similarity` (and `decrypt_error` on failure) on each result in place and
+    returns the scores as a float array, NaN where decryption failed or no score exists.
+    """
+    scores = np.full(len(results), np.nan)
+    pending = [i for i, result in enumerate(results) if "encrypted_similarity" in result]
+
+    decrypted = [_try_decrypt(results[i]["encrypted_similarity"], context) for i in pending]
+    for i, (values, error) in zip(pending, decrypted):
+        result = results[i]
+        if error is not None:
+            result["similarity"] = None
+            result["decrypt_error"] = str(error)
+            logger.error(f"Error decrypting similarity for user {result.get('user_id')}: {error}")
+            continue
+        result["similarity"] = values[0]
+        scores[i] = values[0]
+        logger.debug(
+            f"Decrypted similarity for user {result.get('user_id')}, "
+            f"{result.get('full_name')}: {values[0]:.4f}"
+        )
+
+    # Results that arrived with a plaintext score (e.g. expanded gallery blocks)
+    for i, result in enumerate(results):
+        if "encrypted_similarity" not in result and result.get("similarity") is not None:
+            scores[i] = result["similarity"]
+    return scores
+
+
+def expand_gallery_scores(server_data, context):
+    """
+    Turn a packed gallery response (`encrypted_scores` + `user_ids`) into one
+    result per user. Each ciphertext holds `scores_per_ciphertext` scores in
+    `user_ids` order.
+    """
+    user_ids = server_data.pop("user_ids", [])
+    per_ciphertext = server_data.pop("scores_per_ciphertext")
+    blocks = server_data.pop("encrypted_scores")
+
+    results = []
+    for i, enc_b64 in enumerate(blocks):
+        scores, error = _try_decrypt(enc_b64, context)
+        chunk_ids = user_ids[i * per_ciphertext:(i + 1) * per_ciphertext]
+        if error is not None:
+            logger.error(f"Error decrypting gallery scores block {i}: {error}")
+            results.extend(
+                {"user_id": user_id, "similarity": None, "decrypt_error": str(error)}
+                for user_id in chunk_ids
+            )
+            continue
+        results.extend(
+            {"user_id": user_id, "similarity": score}
+            for user_id, score in zip(chunk_ids, scores)
+        )
+    return results
+
+
+def rank_scores(results, scores, threshold, top_k=5):
+    """Best match, top-k and threshold decision over a score array (NaN = no score)."""
+    valid = np.flatnonzero(~np.isnan(scores))
+    if valid.size == 0:
+        return {
+            "highest_similarity": None,
+            "best_match": None,
+            "match_found": False,
+            "top_matches": [],
+        }
+
+    k = min(max(top_k, 1), valid.size)
+    # argpartition keeps this O(N) for large galleries; only the k winners get sorted
+    top = valid[np.argpartition(-scores[valid], k - 1)[:k]]
+    top = top[np.argsort(-scores[top])]
+    best = top[0]
+    return {
+        "highest_similarity": float(scores[best]),
+        "best_match": results[best],
+        "match_found": bool(scores[best] > threshold),
+        "top_matches": [results[i] for i in top[:max(top_k, 0)]],
+    }
+
+
+def decrypt_and_rank(server_data, context, threshold, top_k=5):
+    """Decrypt all results of a main-server verification response and rank them."""
+    if "encrypted_scores" in server_data:
+        server_data["results"] = expand_gallery_scores(server_data, context)
+    results = server_data.get("results", [])
+    scores = decrypt_results(results, context)
+    server_data.update(rank_scores(results, scores, threshold, top_k))
+    logger.info(
+        f"Decrypted {int(np.count_nonzero(~np.isnan(scores)))}/{len(results)} similarities, "
+        f"highest={server_data['highest_similarity']}"
+    )
+    return server_data
@@ -1,7 +1,21 @@
 import tenseal as ts
 import os
 import base64
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from utils.metrics import CONTEXT_LOAD_SECONDS, CONTEXT_LOADS
+from utils.galois import lean_public_context, rotation_steps
+from utils.packing import slot_count
+from utils.encryption_pool import zero_pool
+
+try:
+    import fcntl
+except ImportError:  # Windows: generate the keys before starting several workers
+    fcntl = None
 
 load_dotenv()
 CONTEXT_DIR = os.getenv("CONTEXT_DIR", "context")
@@ -9,40 +23,242 @@ os.makedirs(CONTEXT_DIR, exist_ok=True)
 
 SECRET_PATH = os.path.join(CONTEXT_DIR, "secret.txt")
 PUBLIC_PATH = os.path.join(CONTEXT_DIR, "public.txt")
+PROFILE_PATH = os.path.join(CONTEXT_DIR, "profile.json")
+LOCK_PATH = os.path.join(CONTEXT_DIR, ".keygen.lock")
+
+# Named CKKS parameter sets. Face matching needs one multiplicative level (the dot
+# product) and ~3 decimal digits; run `python -m utils.calibration` to compare them.
+PARAMETER_PROFILES = {
+    "compact": {
+        "poly_modulus_degree": 8192,
+        "coeff_mod_bit_sizes": [60, 30, 60],
+        "global_scale": 2**30,
+    },
+    "default": {
+        "poly_modulus_degree": 8192,
+        "coeff_mod_bit_sizes": [60, 40, 40, 60],
+        "global_scale": 2**40,
+    },
+    "high-precision": {
+        "poly_modulus_degree": 16384,
+        "coeff_mod_bit_sizes": [60, 50, 50, 50, 60],
+        "global_scale": 2**50,
+    },
+}
+CKKS_PROFILE = os.getenv("CKKS_PROFILE", "default")
+
+# "lean" publishes Galois keys only for the rotations of the dot / matmul kernels on
+# vectors up to GALOIS_KEY_DIM long (see utils/galois.py); "full" keeps every rotation key.
+PUBLIC_GALOIS_KEYS = os.getenv("PUBLIC_GALOIS_KEYS", "lean")
+GALOIS_KEY_DIM = int(os.getenv("GALOIS_KEY_DIM", "4096"))
+# Serve /register-gallery-template/ and /match-gallery/; their matmul needs rotation keys for 1 .. dim-1
+GALLERY_MATCHING = os.getenv("GALLERY_MATCHING", "false").lower() in ("1", "true", "yes")
+GALOIS_KEY_OPS = [
+    op.strip() for op in (os.getenv("GALOIS_KEY_OPS") or ("dot,matmul" if GALLERY_MATCHING else "dot")).split(",")
+    if op.strip()
+]
+
+logger = logging.getLogger(__name__)
 
 def write_data(file_name, data):
     if isinstance(data, bytes):
         data = base64.b64encode(data)
-    with open(file_name, "wb") as f:
+    # Written aside and renamed, so a reader never sees a half-written key file
+    tmp_name = f"{file_name}.tmp"
+    with open(tmp_name, "wb") as f:
         f.write(data)
+    os.replace(tmp_name, file_name)
 
 def read_data(file_name):
     with open(file_name, "rb") as f:
         data = f.read()
     return base64.b64decode(data)
 
-def ensure_context():
-    if not (os.path.exists(SECRET_PATH) and os.path.exists(PUBLIC_PATH)):
-        context = ts.context(
-            ts.SCHEME_TYPE.CKKS,
-            poly_modulus_degree=8192,
-            coeff_mod_bit_sizes=[60, 40, 40, 60]
-        ) #default conteext with p = 200
+def get_profile(name):
+    if name not in PARAMETER_PROFILES:
+        raise ValueError(f"Unknown CKKS profile '{name}'. Choose one of: {', '.join(PARAMETER_PROFILES)}")
+    return PARAMETER_PROFILES[name]
+
+def create_context(profile_name, galois_keys=True):
+    profile = get_profile(profile_name)
+    context = ts.context(
+        ts.SCHEME_TYPE.CKKS,
+        poly_modulus_degree=profile["poly_modulus_degree"],
+        coeff_mod_bit_sizes=profile["coeff_mod_bit_sizes"]
+    )
+    if galois_keys:
         context.generate_galois_keys()
-        context.global_scale = 2**40
+    context.global_scale = profile["global_scale"]
+    return context
+
+def read_profile():
+    """The profile recorded when the context files were generated (None for legacy contexts)."""
+    if not os.path.exists(PROFILE_PATH):
+        return None
+    with open(PROFILE_PATH) as f:
+        return json.load(f)
+
+def write_profile(profile):
+    with open(PROFILE_PATH, "w") as f:
+        json.dump(profile, f, indent=2)
+
+def write_public_context(context, dim=GALOIS_KEY_DIM, kernels=GALOIS_KEY_OPS):
+    """
+    Write public.txt with Galois keys for just the rotations `kernels` need on vectors
+    up to `dim` long, and record the steps in profile.json. Returns the steps.
+    """
+    slots = slot_count(context)
+    steps = rotation_steps(min(dim, slots), slots, kernels)
+    write_data(PUBLIC_PATH, lean_public_context(context, steps))
+    profile = read_profile() or {"profile": "default", **get_profile("default")}
+    profile["galois_keys"] = {"dim": min(dim, slots), "kernels": list(kernels), "steps": steps}
+    write_profile(profile)
+    return steps
 
-        secret_context = context.serialize(save_secret_key=True)
-        write_data(SECRET_PATH, secret_context)
+def _context_files_exist():
+    return os.path.exists(SECRET_PATH) and os.path.exists(PUBLIC_PATH)
 
+@contextmanager
+def _keygen_lock():
+    # Several workers starting at once: one generates the keys, the others wait and load them
+    with open(LOCK_PATH, "w") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+def ensure_context():
+    """Generate the context files if they are missing. Called at startup, not on import."""
+    if not _context_files_exist():
+        with _keygen_lock():
+            if not _context_files_exist():
+                _generate_context()
+                return
+    recorded = read_profile()
+    recorded_name = recorded["profile"] if recorded else "default"  # pre-profile contexts used the default parameters
+    if recorded_name != CKKS_PROFILE:
+        # Never regenerate keys implicitly: every stored template is bound to them
+        logger.warning(
+            f"CKKS_PROFILE is '{CKKS_PROFILE}' but the existing context was generated with "
+            f"'{recorded_name}'. Keeping the existing context; delete {CONTEXT_DIR}/ to switch."
+        )
+    print(f"TenSEAL context files found in {CONTEXT_DIR}/ ({recorded_name} profile). Loading existing context.")
+
+def _generate_context():
+    lean = PUBLIC_GALOIS_KEYS == "lean"
+    # The secret context never needs rotation keys; only the public one carries them
+    context = create_context(CKKS_PROFILE, galois_keys=not lean)
+
+    # Secret first, public last: the public file's presence marks a complete context
+    secret_context = context.serialize(save_secret_key=True)
+    write_data(SECRET_PATH, secret_context)
+    write_profile({"profile": CKKS_PROFILE, **get_profile(CKKS_PROFILE)})
+
+    if lean:
+        write_public_context(context)
+    else:
         context.make_context_public()
         public_context = context.serialize()
         write_data(PUBLIC_PATH, public_context)
-        print(f"TenSEAL context generated and saved in {CONTEXT_DIR}/")
-    else:
-        print(f"TenSEAL context files found in {CONTEXT_DIR}/. Loading existing context.")
+    print(f"TenSEAL context ({CKKS_PROFILE} profile, {PUBLIC_GALOIS_KEYS} Galois keys) generated and saved in {CONTEXT_DIR}/")
+
+
+def _file_signature(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+class ContextRegistry:
+    """
+    Process-wide cache of deserialized TenSEAL contexts, keyed by file path.
+
+    Each context file is decoded and deserialized once and the same object is
+    handed to every caller. A cheap stat() on each lookup detects key files
+    that were replaced on disk, in which case the context is reloaded.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, path):
+        signature = _file_signature(path)
+        entry = self._entries.get(path)
+        if entry is not None and entry["signature"] == signature:
+            return entry["context"]
+
+        with self._lock:
+            # Another thread may have loaded it while we waited for the lock
+            entry = self._entries.get(path)
+            if entry is None or entry["signature"] != signature:
+                entry = self._load(path, signature, entry)
+                self._entries[path] = entry
+            return entry["context"]
+
+    def _load(self, path, signature, previous=None):
+        start = time.perf_counter()
+        data = read_data(path)
+        context = ts.context_from(data)
+        elapsed = time.perf_counter() - start
+
+        reloads = previous["reloads"] + 1 if previous is not None else 0
+        CONTEXT_LOAD_SECONDS.labels(context=os.path.basename(path)).set(elapsed)
+        CONTEXT_LOADS.labels(context=os.path.basename(path)).inc()
+        logger.info(
+            f"Loaded TenSEAL context {path} ({len(data)} bytes) in {elapsed * 1000:.1f} ms"
+            + (f" (reload #{reloads})" if reloads else "")
+        )
+        return {
+            "context": context,
+            "signature": signature,
+            "load_seconds": elapsed,
+            "serialized_bytes": len(data),
+            "loaded_at": time.time(),
+            "reloads": reloads,
+        }
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                os.path.basename(path): {
+                    "load_seconds": entry["load_seconds"],
+                    "serialized_bytes": entry["serialized_bytes"],
+                    "loaded_at": entry["loaded_at"],
+                    "reloads": entry["reloads"],
+                }
+                for path, entry in self._entries.items()
+            }
+        stats["profile"] = read_profile()
+        return stats
+
+
+context_registry = ContextRegistry()
+
+
+def warm_up_contexts():
+    """
+    Load the secret context into the registry so the first request doesn't pay for it.
+    The public context (Galois keys, tens of MiB) is only loaded by the first
+    encrypted compare or gallery match.
+    """
+    load_secret_context()
+
 
 def load_secret_context():
-    return ts.context_from(read_data(SECRET_PATH))
+    return context_registry.get(SECRET_PATH)
 
 def load_public_context():
-    return ts.context_from(read_data(PUBLIC_PATH))
\ No newline at end of file
+    return context_registry.get(PUBLIC_PATH)
+
+def encrypt_vector(vector, context=None):
+    """
+    CKKS-encrypt a plaintext vector and return the serialized ciphertext. Uses a
+    pre-encrypted zero from the background pool when one is ready.
+    """
+    if context is None:
+        context = load_secret_context()
+    return zero_pool.encrypt(context, vector).serialize()
+
+
+if __name__ == "__main__":
+    # Generate the keys ahead of deployment instead of on the first worker's startup
+    ensure_context()
@@ -0,0 +1,189 @@
+import base64
+import json
+import struct
+import lz4.frame
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from utils.metrics import CIPHERTEXT_BYTES
+
+# Binary ciphertext transport.
+#
+# A framed payload is a small header, a JSON metadata block and the raw
+# ciphertexts as length-prefixed frames:
+#
+#   magic "FHEW" | version u8 | flags u8 | meta_len u32 | frame_count u32
+#   meta (UTF-8 JSON, meta_len bytes)
+#   frame_count x [ frame_flags u8 | length u64 | bytes ]
+#
+# The metadata is the same object a JSON client would receive, except that every
+# ciphertext value is replaced by {"$frame": i} pointing at frame i. Frames whose
+# flags have FLAG_LZ4 set are lz4-frame compressed.
+
+BINARY_MEDIA_TYPE = "application/octet-stream"
+MAGIC = b"FHEW"
+VERSION = 1
+FLAG_LZ4 = 0x01
+
+_HEADER = struct.Struct("<4sBBII")
+_FRAME = struct.Struct("<BQ")
+# Largest frame accepted after lz4 decompression; payloads come from clients
+MAX_FRAME_BYTES = 64 * 2**20
+
+
+def _qvalues(header: str) -> dict:
+    """{token: q} for an Accept / Accept-Encoding header; entries without q= count as 1."""
+    values = {}
+    for entry in header.split(","):
+        token, *params = [part.strip() for part in entry.split(";")]
+        if not token:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        values[token.lower()] = q
+    return values
+
+
+def wants_binary(request: Request) -> bool:
+    # Named explicitly with q > 0 and not ranked below JSON; wildcards keep the JSON default
+    accept = _qvalues(request.headers.get("accept", ""))
+    q = accept.get(BINARY_MEDIA_TYPE, 0.0)
+    return q > 0 and q >= accept.get("application/json", 0.0)
+
+
+def wants_lz4(request: Request) -> bool:
+    return _qvalues(request.headers.get("accept-encoding", "")).get("lz4", 0.0) > 0
+
+
+def _replace_bytes(obj, fn):
+    if isinstance(obj, (bytes, bytearray)):
+        return fn(bytes(obj))
+    if isinstance(obj, dict):
+        return {k: _replace_bytes(v, fn) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_replace_bytes(v, fn) for v in obj]
+    return obj
+
+
+def to_json_payload(payload):
+    """Base64-encode every ciphertext (bytes value) for the JSON transport."""
+    return _replace_bytes(payload, lambda b: base64.b64encode(b).decode("utf-8"))
+
+
+def encode_frames(payload, compress=False) -> bytes:
+    frames = []
+
+    def to_ref(data):
+        frames.append(data)
+        return {"$frame": len(frames) - 1}
+
+    meta = json.dumps(_replace_bytes(payload, to_ref)).encode("utf-8")
+    parts = [_HEADER.pack(MAGIC, VERSION, FLAG_LZ4 if compress else 0, len(meta), len(frames)), meta]
+    for data in frames:
+        flags = 0
+        if compress:
+            packed = lz4.frame.compress(data)
+            # CKKS ciphertexts are already compressed by SEAL; keep whichever is smaller
+            if len(packed) < len(data):
+                data, flags = packed, FLAG_LZ4
+        parts.append(_FRAME.pack(flags, len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def is_framed(data: bytes) -> bool:
+    return data[:len(MAGIC)] == MAGIC
+
+
+def _decompress(frame: bytes) -> bytes:
+    decompressor = lz4.frame.LZ4FrameDecompressor()
+    try:
+        data = decompressor.decompress(frame, max_length=MAX_FRAME_BYTES)
+    except RuntimeError as e:
+        raise ValueError(f"Invalid lz4 frame: {e}")
+    if not decompressor.eof:
+        raise ValueError(f"lz4 frame is truncated or decompresses to more than {MAX_FRAME_BYTES} bytes")
+    return data
+
+
+def decode_frames(data: bytes):
+    """
+    Inverse of encode_frames: returns the payload with ciphertexts restored as bytes.
+    Raises ValueError for anything malformed, since uploads are framed by clients.
+    """
+    if len(data) < _HEADER.size:
+        raise ValueError("Truncated framed payload header")
+    magic, version, _, meta_len, count = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a framed ciphertext payload")
+    if version != VERSION:
+        raise ValueError(f"Unsupported framed payload version {version}")
+    offset = _HEADER.size
+    if len(data) < offset + meta_len:
+        raise ValueError("Truncated framed payload metadata")
+    meta = json.loads(data[offset:offset + meta_len])
+    offset += meta_len
+
+    frames = []
+    for _ in range(count):
+        if len(data) < offset + _FRAME.size:
+            raise ValueError("Truncated framed payload")
+        flags, length = _FRAME.unpack_from(data, offset)
+        offset += _FRAME.size
+        frame = data[offset:offset + length]
+        if len(frame) != length:
+            raise ValueError("Truncated framed payload")
+        offset += length
+        frames.append(_decompress(frame) if flags & FLAG_LZ4 else frame)
+
+    def restore(obj):
+        if isinstance(obj, dict):
+            if set(obj) == {"$frame"}:
+                index = obj["$frame"]
+                if not isinstance(index, int) or not 0 <= index < len(frames):
+                    raise ValueError(f"Framed payload refers to missing frame {index!r}")
+                return frames[index]
+            return {k: restore(v) for k, v in obj.items()}
+        if isinstance(obj, list):
+            return [restore(v) for v in obj]
+        return obj
+
+    return restore(meta)
+
+
+def read_ciphertext(data: bytes) -> bytes:
+    """An uploaded ciphertext is either raw SEAL bytes or a framed payload holding one."""
+    if not is_framed(data):
+        return data
+    payload = decode_frames(data)
+    if not isinstance(payload, (bytes, bytearray)):
+        raise ValueError("Framed upload must contain a single ciphertext")
+    return payload
+
+
+def ciphertext_response(request: Request, payload):
+    """
+    Return `payload` (a JSON-able object whose ciphertexts are bytes) in the format the
+    client asked for: framed binary for `Accept: application/octet-stream`, lz4 frames
+    when `Accept-Encoding` also lists lz4, and base64-in-JSON otherwise.
+    """
+    if wants_binary(request):
+        compress = wants_lz4(request)
+        headers = {"X-FHE-Compression": "lz4"} if compress else None
+        response = Response(encode_frames(payload, compress), media_type=BINARY_MEDIA_TYPE, headers=headers)
+    else:
+        response = JSONResponse(to_json_payload(payload))
+    CIPHERTEXT_BYTES.labels(direction="served").observe(len(response.body))
+    return response
+
+
+def parse_response(content_type: str, body: bytes):
+    """Decode a main-server response that may be framed binary or JSON."""
+    if content_type.startswith(BINARY_MEDIA_TYPE):
+        return decode_frames(body)
+    return json.loads(body)
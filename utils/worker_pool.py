@@ -0,0 +1,137 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, status
+from dotenv import load_dotenv
+from prometheus_client import Gauge
+from utils.metrics import record_stage
+
+load_dotenv()
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", os.cpu_count() or 2))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", 2 * WORKER_POOL_SIZE))
+WORKER_RETRY_AFTER = os.getenv("WORKER_RETRY_AFTER", "1")
+
+logger = logging.getLogger(__name__)
+
+
+class PoolBusy(Exception):
+    pass
+
+
+# Set once a request has passed admission; its later stages are queued without the check,
+# so a request is only ever turned away before its first stage, not halfway through
+_admitted = contextvars.ContextVar("worker_pool_admitted", default=False)
+
+
+def begin_request():
+    """Start a new unit of admission in the current context, e.g. each frame of a stream."""
+    _admitted.set(False)
+
+
+class WorkerPool:
+    """
+    Bounded thread pool for the CPU-bound stages (DeepFace, TenSEAL).
+
+    At most `workers` jobs run at once and at most `max_queue` more wait for a
+    worker. A request whose first job finds the pool beyond that is rejected
+    immediately with PoolBusy instead of piling up behind slow requests on the
+    event loop; once admitted, its later jobs always queue.
+    """
+
+    def __init__(self, workers, max_queue):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cpu-worker")
+        self._lock = threading.Lock()
+        self._pending = 0  # queued + running
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _admit(self):
+        with self._lock:
+            if not _admitted.get() and self._pending >= self.workers + self.max_queue:
+                self._rejected += 1
+                raise PoolBusy(f"Worker pool full ({self._pending} jobs in flight)")
+            self._pending += 1
+        _admitted.set(True)
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        self._admit()
+        submitted = time.perf_counter()
+
+        def job():
+            wait = time.perf_counter() - submitted
+            with self._lock:
+                self._running += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+            record_stage("worker_wait", wait)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+
+        # Run in a copy of the caller's context so stage timings reach the request
+        ctx = contextvars.copy_context()
+        try:
+            future = self._executor.submit(ctx.run, job)
+        except RuntimeError:  # executor shut down
+            self._release()
+            raise
+        # Released when the job itself finishes or is cancelled, not when the caller stops
+        # waiting: a cancelled request's job still holds its worker until it returns
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                "workers": self.workers,
+                "queue_capacity": self.max_queue,
+                "running": self._running,
+                "queue_depth": self._pending - self._running,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "avg_wait_seconds": self._total_wait / started if started else 0.0,
+                "max_wait_seconds": self._max_wait,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+worker_pool = WorkerPool(WORKER_POOL_SIZE, WORKER_QUEUE_SIZE)
+
+for _name, _doc in [
+    ("running", "Jobs running on the CPU worker pool"),
+    ("queue_depth", "Jobs waiting for a CPU worker"),
+    ("rejected", "Jobs rejected because the worker pool was full"),
+]:
+    Gauge(f"fhe_worker_pool_{_name}", _doc).set_function(lambda key=_name: worker_pool.stats()[key])
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """Run a CPU-bound call on the shared worker pool; 503 with Retry-After when it is full."""
+    try:
+        return await worker_pool.run(fn, *args, **kwargs)
+    except PoolBusy as e:
+        logger.warning(str(e))
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy processing other requests. Please retry shortly.",
+            headers={"Retry-After": WORKER_RETRY_AFTER},
+        )